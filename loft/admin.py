@@ -10,6 +10,7 @@ from .models import *
 admin.site.register(ImageProduct)
 admin.site.register(ProductModel)
 admin.site.register(FavoriteProduct)
+admin.site.register(ProductRecommendation)
 
 # Модельки заказа
 admin.site.register(Customer)
@@ -32,7 +33,7 @@ class CategoryAdmin(admin.ModelAdmin):
     def get_icon_category(self, obj):
         if obj.icon:
             try:
-                return mark_safe(f'<img src="{obj.icon.url}" width="30" >')
+                return mark_safe(f'<img src="{obj.get_rendition_url(30, "jpeg")}" width="30" >')
             except:
                 return '-'
         else:
@@ -55,18 +56,20 @@ class ProductAdmin(admin.ModelAdmin):
     list_editable = ['quantity', 'price', 'discount', 'model']
     list_filter = ['category', 'color_name', 'price']
 
+    # Фото товаров загружаем одним запросом на страницу списка
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_images()
+
     def get_photo(self, obj):
-        if obj.images:
-            try:
-                return mark_safe(f'<img src="{obj.images.first().image.url}" width="60" >')
-            except:
-                return '-'
+        image = obj.get_first_image()
+        if image:
+            return mark_safe(f'<img src="{image.get_rendition_url(60, "jpeg")}" width="60" >')
         else:
             return '-'
 
-
-
-
-
-
-
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'kind', 'status', 'attempts', 'run_after', 'created_at', 'updated_at')
+    list_display_links = ('pk', 'kind')
+    list_filter = ['status', 'kind']
+    readonly_fields = ['locked_at', 'created_at', 'updated_at']
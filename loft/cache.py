@@ -0,0 +1,75 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.http import urlencode
+from .instrumentation import render_response
+
+
+# Версионированные ключи кэша: при изменении данных увеличиваем версию пространства
+# имён, старые ключи просто перестают читаться и вытесняются кэшем сами.
+def get_version(namespace):
+    key = f'loft:{namespace}:version'
+    version = cache.get(key)
+    if version is None:
+        # Начинаем со времени, чтобы после вытеснения версии не попасть на старые ключи
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace):
+    key = f'loft:{namespace}:version'
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = time.time_ns()
+        cache.set(key, version, None)
+        return version
+
+
+def versioned_key(namespace, *parts):
+    key = f'loft:{namespace}:v{get_version(namespace)}'
+    return ':'.join([key, *map(str, parts)])
+
+
+# Кэш готовых страниц каталога для анонимных посетителей.
+# Ключ: url name + аргументы url + нормализованные параметры фильтра + версия каталога,
+# которую увеличивают изменения товаров, категорий и фото (см. signals.py).
+# Параметр входит в ключ, если он есть в запросе, даже пустой: ?cursor= включает keyset режим.
+# Время жизни - cache_timeout или настройка LOFT_PAGE_CACHE_TIMEOUT на момент запроса.
+# Страницы авторизованных пользователей (корзина, избранное) в кэш не попадают.
+class CatalogCacheMixin:
+    cache_params = ('sub', 'color_name', 'model', 'from', 'till', 'page', 'cursor')
+    cache_timeout = None
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != 'GET' or request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+
+        key = self.get_cache_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = super().dispatch(request, *args, **kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            render_response(request, response)
+        # Страницы с csrf токеном у каждого посетителя свои - такие не кэшируем
+        if response.status_code == 200 and not response.cookies and \
+                not request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+            cache.set(key, (response.content, response['Content-Type']), self.get_cache_timeout())
+        return response
+
+    def get_cache_key(self, request):
+        params = sorted((key, request.GET[key]) for key in self.cache_params if key in request.GET)
+        arguments = sorted(self.kwargs.items())
+        digest = hashlib.md5(urlencode(arguments + params).encode()).hexdigest()
+        return versioned_key('catalog', request.resolver_match.url_name, digest)
+
+    def get_cache_timeout(self):
+        if self.cache_timeout is not None:
+            return self.cache_timeout
+        return getattr(settings, 'LOFT_PAGE_CACHE_TIMEOUT', 60 * 10)
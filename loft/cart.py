@@ -0,0 +1,87 @@
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Order, OrderProduct
+
+
+CART_ACTIONS = ('add', 'delete', 'remove', 'set')
+IDEMPOTENCY_TIMEOUT = 60 * 60 * 24
+IDEMPOTENCY_PENDING = 'pending'
+
+
+class CartError(ValueError):
+    pass
+
+
+# Изменение строки корзины без чтения строки: условный UPDATE, а если строки нет - INSERT.
+# add - плюс один (не больше остатка), delete - минус один, remove - убрать товар, set - задать количество.
+# product - товар с загруженными pk и quantity (остаток). Возвращает новое количество товара в корзине.
+def update_cart_line(order, product, action, quantity=None):
+    if action not in CART_ACTIONS:
+        raise CartError(f'Неизвестное действие "{action}"')
+
+    # Заказ, переданный на оплату, не меняется, даже если запрос получил его до фиксации
+    lines = OrderProduct.objects.filter(order=order, order__awaiting_payment=False, order__payment=False,
+                                        product_id=product.pk)
+    now = timezone.now()
+    updated = 0  # update() не вызывает сигналы, суммы заказа в этом случае пересчитываем сами
+
+    if action == 'add':
+        updated = lines.filter(quantity__lt=product.quantity).update(quantity=F('quantity') + 1, updated_at=now)
+        if not updated and product.quantity > 0:
+            insert_line(order, product, 1)
+    elif action == 'delete':
+        updated = lines.filter(quantity__gt=1).update(quantity=F('quantity') - 1, updated_at=now)
+        if not updated:
+            lines.delete()
+    elif action == 'remove':
+        lines.delete()
+    else:
+        if quantity is None or quantity < 0:
+            raise CartError('Количество должно быть неотрицательным числом')
+        quantity = min(quantity, max(product.quantity, 0))
+        if quantity == 0:
+            lines.delete()
+        else:
+            updated = lines.update(quantity=quantity, updated_at=now)
+            if not updated and not insert_line(order, product, quantity):
+                updated = lines.update(quantity=quantity, updated_at=now)
+
+    if updated:
+        Order.objects.filter(pk=order.pk).update_totals()
+    return lines.values_list('quantity', flat=True).first() or 0
+
+
+# Вставка строки, уникальность (order, product) защищает от дублей при параллельных запросах
+def insert_line(order, product, quantity):
+    try:
+        with transaction.atomic():
+            OrderProduct.objects.create(order=order, product_id=product.pk, quantity=quantity)
+        return True
+    except IntegrityError:
+        return False
+
+
+def get_idempotency_key(user_id, key):
+    return f'loft:cart:idempotency:{user_id}:{key}'
+
+
+# Повтор запроса с тем же ключом (двойной клик, повтор после обрыва сети) не меняет корзину повторно,
+# а возвращает сохранённый ответ. Пока первый запрос не завершён, повтор получает None.
+def run_idempotent(user_id, key, func):
+    if not key:
+        return func()
+
+    cache_key = get_idempotency_key(user_id, key)
+    if not cache.add(cache_key, IDEMPOTENCY_PENDING, IDEMPOTENCY_TIMEOUT):
+        result = cache.get(cache_key)
+        return None if result == IDEMPOTENCY_PENDING else result
+
+    try:
+        result = func()
+    except Exception:
+        cache.delete(cache_key)
+        raise
+    cache.set(cache_key, result, IDEMPOTENCY_TIMEOUT)
+    return result
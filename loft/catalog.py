@@ -0,0 +1,128 @@
+from dataclasses import dataclass
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.urls import reverse
+from .cache import versioned_key
+from .models import Category, Product, ProductRecommendation
+
+
+CATEGORY_TREE_TIMEOUT = getattr(settings, 'LOFT_CATEGORY_TREE_TIMEOUT', 60 * 10)
+RECOMMENDATIONS_LIMIT = getattr(settings, 'LOFT_RECOMMENDATIONS_LIMIT', 8)
+RECOMMENDATIONS_TIMEOUT = 60 * 60
+
+
+# Подкатегории узла: в шаблонах работают как category.subcategories.all у модели
+class CategoryNodes(tuple):
+    def all(self):
+        return self
+
+    def count(self):
+        return len(self)
+
+    def exists(self):
+        return bool(self)
+
+
+# Узел дерева категорий, который можно хранить в кэше
+@dataclass(frozen=True)
+class CategoryNode:
+    pk: int
+    title: str
+    slug: str
+    url: str
+    icon: str
+    children: tuple = ()
+
+    # Те же методы, что и у модели Category, для шаблонов
+    def get_absolute_url(self):
+        return self.url
+
+    def get_icon(self):
+        return self.icon
+
+    @property
+    def subcategories(self):
+        return CategoryNodes(self.children)
+
+    def __str__(self):
+        return self.title
+
+
+# Дерево категорий (родитель -> подкатегории) одним запросом, хранится в кэше
+# до изменения любой категории (см. signals.py). Сброс по версии виден другим процессам
+# только при общем кэше (Redis, Memcached), с LocMemCache - по истечении таймаута
+def get_category_tree():
+    key = versioned_key('category_tree')
+    tree = cache.get(key)
+    if tree is None:
+        tree = build_category_tree()
+        cache.set(key, tree, CATEGORY_TREE_TIMEOUT)
+    return tree
+
+
+def build_category_tree():
+    categories = list(Category.objects.order_by('pk'))
+    children = {}
+    for category in categories:
+        children.setdefault(category.parent_id, []).append(category)
+
+    def build(category):
+        return CategoryNode(
+            pk=category.pk,
+            title=category.title,
+            slug=category.slug,
+            url=reverse('category', kwargs={'slug': category.slug}) if category.slug else '',
+            icon=category.get_icon(),
+            children=tuple(build(child) for child in children.get(category.pk, []))
+        )
+
+    return [build(category) for category in children.get(None, [])]
+
+
+# Варианты товаров (та же модель и категория, другой цвет) для целой страницы
+# одним запросом: {(model_id, category_id): [товары]}
+def get_product_variants(products):
+    groups = {(product.model_id, product.category_id) for product in products}
+    variants = {group: [] for group in groups}
+    if not groups:
+        return variants
+
+    condition = Q()
+    for model_id, category_id in groups:
+        condition |= Q(model_id=model_id, category_id=category_id)
+
+    for product in Product.objects.filter(condition).order_by('pk'):
+        variants[(product.model_id, product.category_id)].append(product)
+    return variants
+
+
+# Рекомендованные товары из той же категории (не больше limit).
+# В кэше храним только id, сами товары с фото достаём одним запросом.
+def get_recommended_products(product, limit=RECOMMENDATIONS_LIMIT):
+    key = versioned_key('catalog', 'recommended', product.pk, limit)
+    ids = cache.get(key)
+    if ids is None:
+        ids = list(Product.objects.filter(category_id=product.category_id).exclude(pk=product.pk)
+                   .order_by('-created_at', '-pk').values_list('pk', flat=True)[:limit])
+        cache.set(key, ids, RECOMMENDATIONS_TIMEOUT)
+
+    products = {i.pk: i for i in Product.objects.filter(pk__in=ids).with_images()} if ids else {}
+    return [products[pk] for pk in ids if pk in products]
+
+
+# "С этим покупают": готовые соседи товаров из таблицы рекомендаций, один запрос по индексу
+# (product, rank) плюс фото. Товары из exclude (например, уже в корзине) не предлагаем.
+def get_bought_together(product_ids, limit=RECOMMENDATIONS_LIMIT, exclude=()):
+    exclude = set(exclude) | set(product_ids)
+    recommendations = (ProductRecommendation.objects.filter(product_id__in=product_ids)
+                       .exclude(recommended_id__in=exclude)
+                       .select_related('recommended').order_by('-score', 'rank')
+                       .prefetch_related('recommended__images'))
+
+    products = {}
+    for recommendation in recommendations[:limit * 3]:
+        products.setdefault(recommendation.recommended_id, recommendation.recommended)
+        if len(products) >= limit:
+            break
+    return list(products.values())
@@ -0,0 +1,9 @@
+from django.utils.functional import SimpleLazyObject
+from .favorites import get_favorite_ids
+
+
+# id избранных товаров текущего пользователя для всех шаблонов (загружается только при обращении)
+def favorites(request):
+    return {
+        'favorite_ids': SimpleLazyObject(lambda: get_favorite_ids(request.user))
+    }
@@ -0,0 +1,22 @@
+from django.db.models import Count
+from .models import Product, ProductModel
+
+
+# Фасеты для сайдбара фильтра категории: цвета, модели и подкатегории со счётчиками.
+# Каждый фасет считается одним агрегирующим запросом, поэтому сайдбар стоит
+# фиксированное число запросов независимо от количества товаров.
+def get_category_facets(category):
+    products = Product.objects.filter(category__parent=category)
+
+    colors = list(products.values('color_name').annotate(count=Count('pk')).order_by('color_name'))
+
+    models = list(ProductModel.objects.filter(product__category__parent=category)
+                  .annotate(products_count=Count('product')).order_by('title'))
+
+    subcategories = list(category.subcategories.annotate(products_count=Count('products')).order_by('pk'))
+
+    return {
+        'colors': colors,
+        'models': models,
+        'subcategories': subcategories
+    }
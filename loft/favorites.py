@@ -0,0 +1,41 @@
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from .models import FavoriteProduct
+
+
+FAVORITES_TIMEOUT = 60 * 60
+
+
+def get_favorites_key(user_id):
+    return f'loft:favorites:{user_id}'
+
+
+# Множество id избранных товаров пользователя, хранится в кэше.
+# Шаблоны проверяют {% if product.pk in favorite_ids %} без запросов на каждую карточку.
+def get_favorite_ids(user):
+    if not user.is_authenticated:
+        return frozenset()
+
+    key = get_favorites_key(user.pk)
+    favorite_ids = cache.get(key)
+    if favorite_ids is None:
+        favorite_ids = frozenset(FavoriteProduct.objects.filter(user=user).values_list('product_id', flat=True))
+        cache.set(key, favorite_ids, FAVORITES_TIMEOUT)
+    return favorite_ids
+
+
+# Добавить или убрать товар из избранного: один DELETE, а если удалять нечего - один INSERT.
+# Возвращает True, если товар добавлен.
+def toggle_favorite(user, product_id):
+    deleted, _ = FavoriteProduct.objects.filter(user=user, product_id=product_id).delete()
+    added = False
+    if not deleted:
+        try:
+            with transaction.atomic():
+                FavoriteProduct.objects.create(user=user, product_id=product_id)
+            added = True
+        except IntegrityError:
+            pass  # Параллельный запрос уже добавил товар (уникальность user + product)
+
+    cache.delete(get_favorites_key(user.pk))
+    return added
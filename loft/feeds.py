@@ -0,0 +1,183 @@
+import csv
+import json
+from dataclasses import dataclass, field
+from itertools import islice
+from django.db import transaction
+from django.utils import timezone
+from .models import Category, Product, ProductModel, Order
+from .jobs import enqueue_index_products
+
+
+# Колонки файла выгрузки/загрузки. Категория задаётся слагом, модель - названием (слага у модели нет)
+FIELDS = ['slug', 'title', 'description', 'price', 'quantity', 'color_name', 'color_code',
+          'width', 'depth', 'height', 'discount', 'category', 'model']
+PRODUCT_FIELDS = ['title', 'description', 'price', 'quantity', 'color_name', 'color_code',
+                  'width', 'depth', 'height', 'discount']
+CONVERTERS = {
+    'price': float,
+    'quantity': int,
+    'discount': lambda value: int(value) if value not in ('', None) else None,
+}
+# Без них новый товар не сохранить: price в базе NOT NULL, пустое название и категория бессмысленны
+NEW_PRODUCT_REQUIRED = ('title', 'price', 'category')
+FORMATS = ('csv', 'jsonl')
+
+
+class FeedError(ValueError):
+    pass
+
+
+def get_format(path, fmt=None):
+    fmt = fmt or path.rsplit('.', 1)[-1].lower()
+    if fmt not in FORMATS:
+        raise FeedError(f'Неизвестный формат "{fmt}", поддерживаются: {", ".join(FORMATS)}')
+    return fmt
+
+
+# Строки файла по одной, весь файл в память не читаем.
+# Возвращает пары (номер строки, dict); для строки с битым JSON вместо dict - FeedError,
+# import_products запишет её в ошибки и продолжит со следующей
+def read_rows(file, fmt):
+    if fmt == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_num, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_num, json.loads(line)
+            except json.JSONDecodeError as error:
+                yield line_num, FeedError(f'Некорректный JSON: {error}')
+
+
+def write_rows(file, fmt, rows):
+    if fmt == 'csv':
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            file.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+# Товары для выгрузки: один запрос, читается курсором по chunk_size строк
+def export_rows(queryset=None, chunk_size=2000):
+    queryset = (queryset if queryset is not None else Product.objects.all()).order_by('pk')
+    values = queryset.values(*['slug'] + PRODUCT_FIELDS, 'category__slug', 'model__title')
+    for row in values.iterator(chunk_size=chunk_size):
+        row['category'] = row.pop('category__slug')
+        row['model'] = row.pop('model__title') or ''
+        if row['discount'] is None:
+            row['discount'] = ''
+        yield row
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    updated: int = 0
+    errors: list = field(default_factory=list)  # (номер строки, текст ошибки)
+
+
+# Загрузка товаров пачками: на каждую пачку - поиск категорий, моделей и существующих
+# товаров по слагу (3 запроса), затем bulk_create новых и bulk_update найденных.
+# bulk-операции не вызывают сигналы, поэтому задачу индексации, суммы корзин и версию каталога обновляем сами.
+def import_products(rows, batch_size=1000, create_models=True):
+    result = ImportResult()
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        with transaction.atomic():
+            import_batch(batch, result, create_models)
+    return result
+
+
+def import_batch(batch, result, create_models):
+    parsed = {}
+    for line_num, row in batch:
+        if isinstance(row, FeedError):
+            result.errors.append((line_num, str(row)))
+            continue
+        try:
+            parsed[row['slug']] = (line_num, parse_row(row))  # Повтор слага в пачке - берём последний
+        except (KeyError, TypeError, ValueError, AttributeError) as error:
+            result.errors.append((line_num, f'{type(error).__name__}: {error}'))
+    if not parsed:
+        return
+
+    category_slugs = {data['category'] for _, data in parsed.values() if 'category' in data}
+    categories = Category.objects.in_bulk(category_slugs, field_name='slug')
+    models = get_models({data['model'] for _, data in parsed.values() if data.get('model')}, create_models)
+    existing = Product.objects.select_related('model').in_bulk(list(parsed), field_name='slug')
+
+    to_create, to_update, update_fields = [], [], {'updated_at'}
+    now = timezone.now()
+    for slug, (line_num, data) in parsed.items():
+        product = existing.get(slug)
+        if 'category' in data and data['category'] not in categories:
+            result.errors.append((line_num, f'Категория "{data["category"]}" не найдена'))
+            continue
+        if data.get('model') and data['model'] not in models:
+            result.errors.append((line_num, f'Модель "{data["model"]}" не найдена'))
+            continue
+        missing = [name for name in NEW_PRODUCT_REQUIRED if name not in data] if product is None else []
+        if missing:
+            result.errors.append((line_num, f'Для нового товара нужны поля: {", ".join(missing)}'))
+            continue
+
+        product = product or Product(slug=slug)
+        for name in PRODUCT_FIELDS:
+            if name in data:
+                setattr(product, name, data[name])
+        if 'category' in data:
+            product.category = categories[data['category']]
+        if 'model' in data:
+            product.model = models.get(data['model'])
+
+        if product.pk:
+            product.updated_at = now
+            update_fields.update(name for name in PRODUCT_FIELDS if name in data)
+            update_fields.update(name for name in ('category', 'model') if name in data)
+            to_update.append(product)
+        else:
+            to_create.append(product)
+
+    Product.objects.bulk_create(to_create)
+    if to_update:
+        Product.objects.bulk_update(to_update, sorted(update_fields))
+        # Цены могли измениться - пересчитываем неоплаченные корзины с этими товарами
+        Order.objects.filter(payment=False, awaiting_payment=False,
+                             orderproduct__product__in=to_update).update_totals()
+    enqueue_index_products(product.pk for product in to_create + to_update)
+
+    result.created += len(to_create)
+    result.updated += len(to_update)
+
+
+# Пустые значения из CSV для числовых полей и модели означают "не задано"
+def parse_row(row):
+    if not row.get('slug'):
+        raise ValueError('не указан slug')
+    data = {}
+    for name in PRODUCT_FIELDS + ['category', 'model']:
+        if name not in row:
+            continue
+        value = row[name]
+        if value in ('', None) and name in CONVERTERS and name != 'discount':
+            continue
+        if name in CONVERTERS:
+            value = CONVERTERS[name](value)
+        elif value is None:
+            value = ''
+        data[name] = value
+    return data
+
+
+def get_models(titles, create_missing):
+    models = {model.title: model for model in ProductModel.objects.filter(title__in=titles)}
+    missing = titles - models.keys()
+    if missing and create_missing:
+        created = ProductModel.objects.bulk_create([ProductModel(title=title) for title in sorted(missing)])
+        models.update((model.title, model) for model in created)
+    return models
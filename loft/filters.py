@@ -0,0 +1,42 @@
+from .models import Product
+
+
+# Класс для фильтрации товаров категории по GET параметрам
+class ProductFilter:
+    params = ('sub', 'color_name', 'model', 'from', 'till')
+
+    def __init__(self, category, query):
+        self.category = category
+        self.data = {key: query.get(key) for key in self.params if query.get(key)}
+
+    # Товары всех подкатегорий категории одним запросом (вместо category__in=[...])
+    def base_queryset(self):
+        return Product.objects.filter(category__parent=self.category)
+
+    # Собираем один queryset из всех фильтров, чтобы пагинация делала LIMIT/OFFSET в базе
+    def get_queryset(self):
+        products = self.base_queryset()
+
+        if self.data.get('sub'):
+            products = products.filter(category__title=self.data['sub'])
+        if self.data.get('color_name'):
+            products = products.filter(color_name=self.data['color_name'])
+        if self.data.get('model'):
+            products = products.filter(model__title=self.data['model'])
+
+        price_from = self.get_price('from')
+        price_till = self.get_price('till')
+        if price_from is not None:
+            products = products.filter(price__gte=price_from)
+        if price_till is not None:
+            # Раньше сравнивали int(price) <= till, т.е. цена строго меньше till + 1
+            products = products.filter(price__lt=price_till + 1)
+
+        return products.with_images().order_by('-created_at', '-pk')
+
+    # Цена из параметра, некорректные значения просто игнорируем
+    def get_price(self, key):
+        try:
+            return int(self.data[key])
+        except (KeyError, ValueError):
+            return None
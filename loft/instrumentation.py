@@ -0,0 +1,176 @@
+import json
+import logging
+import time
+from collections import Counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+
+logger = logging.getLogger('loft.instrumentation')
+
+REPORT_KEY = 'loft:instrumentation:report'
+REPORT_SAMPLES = 200  # Сколько последних замеров храним для p50/p95
+
+
+# Сбор статистики одного запроса: оборачивает каждый SQL запрос через execute_wrapper
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.signatures = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            self.signatures[sql] += 1  # Параметры передаются отдельно, sql - это сигнатура запроса
+
+    # Одинаковые запросы, выполненные несколько раз (типичный признак N+1)
+    def get_duplicates(self):
+        return {sql: count for sql, count in self.signatures.most_common(5) if count > 1}
+
+
+# Middleware для замера запросов к базе, времени рендера шаблона и общего времени ответа.
+# Результаты пишутся в лог loft.instrumentation и в отчёт по url name (см. instrumentation_report_view)
+class QueryInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'LOFT_INSTRUMENTATION', False)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+
+        stats = RequestStats()
+        request.instrumentation = stats
+        start = time.perf_counter()
+        with connection.execute_wrapper(stats):
+            response = self.get_response(request)
+        self.finish(request, response, stats, time.perf_counter() - start)
+        return response
+
+    # Под ASGI синхронный код одного запроса (и запросы к базе) выполняется в одном потоке,
+    # поэтому обёртку ставим на соединение этого потока через sync_to_async
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+
+        stats = RequestStats()
+        request.instrumentation = stats
+        start = time.perf_counter()
+        await sync_to_async(add_execute_wrapper)(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(remove_execute_wrapper)(stats)
+        await sync_to_async(self.finish)(request, response, stats, time.perf_counter() - start)
+        return response
+
+    def finish(self, request, response, stats, total_time):
+        match = request.resolver_match
+        record = {
+            'url_name': match.url_name if match and match.url_name else 'unresolved',
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': stats.queries,
+            'duplicate_queries': sum(count - 1 for count in stats.signatures.values()),
+            'db_ms': round(stats.db_time * 1000, 2),
+            'template_ms': round(stats.template_time * 1000, 2),
+            'total_ms': round(total_time * 1000, 2),
+        }
+        logger.info(json.dumps(record, ensure_ascii=False))
+        for sql, count in stats.get_duplicates().items():
+            logger.debug('N+1 в %s: %s раз - %s', record['url_name'], count, sql)
+
+        add_to_report(record)
+
+    # Для TemplateResponse (все ListView/DetailView) рендерим сами, чтобы замерить время шаблона.
+    # Во вьюшках с render() время шаблона входит во время вьюшки.
+    def process_template_response(self, request, response):
+        if getattr(request, 'instrumentation', None) is not None:
+            render_response(request, response)
+        return response
+
+
+# Рендер TemplateResponse с замером времени шаблона. Нужен и вне middleware:
+# CatalogCacheMixin рендерит страницу сам, чтобы положить её в кэш, и повторный
+# render() в process_template_response уже ничего не делает.
+def render_response(request, response):
+    start = time.perf_counter()
+    response.render()
+    stats = getattr(request, 'instrumentation', None)
+    if stats is not None:
+        stats.template_time += time.perf_counter() - start
+    return response
+
+
+# connection - прокси, соединение выбирается в момент вызова, поэтому вызываем в нужном потоке
+def add_execute_wrapper(wrapper):
+    connection.execute_wrappers.append(wrapper)
+
+
+def remove_execute_wrapper(wrapper):
+    connection.execute_wrappers.remove(wrapper)
+
+
+# Сводка по каждому url name хранится в кэше, чтобы её видели все процессы.
+# Обновление не атомарное, при параллельных запросах часть замеров может потеряться.
+def add_to_report(record):
+    report = cache.get(REPORT_KEY) or {}
+    row = report.setdefault(record['url_name'], {
+        'requests': 0, 'queries': 0, 'duplicate_queries': 0,
+        'db_ms': 0.0, 'template_ms': 0.0, 'total_ms': 0.0, 'max_ms': 0.0, 'samples': []
+    })
+    row['requests'] += 1
+    for field in ('queries', 'duplicate_queries', 'db_ms', 'template_ms', 'total_ms'):
+        row[field] += record[field]
+    row['max_ms'] = max(row['max_ms'], record['total_ms'])
+    row['samples'] = (row['samples'] + [record['total_ms']])[-REPORT_SAMPLES:]
+    cache.set(REPORT_KEY, report, None)
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    if not values:
+        return 0
+    index = min(len(values) - 1, round(percent / 100 * (len(values) - 1)))
+    return values[index]
+
+
+# Строки отчёта со средними значениями, самые медленные вьюшки сверху
+def get_report():
+    rows = []
+    for url_name, row in (cache.get(REPORT_KEY) or {}).items():
+        requests = row['requests']
+        rows.append({
+            'url_name': url_name,
+            'requests': requests,
+            'avg_queries': round(row['queries'] / requests, 1),
+            'avg_duplicate_queries': round(row['duplicate_queries'] / requests, 1),
+            'avg_db_ms': round(row['db_ms'] / requests, 2),
+            'avg_template_ms': round(row['template_ms'] / requests, 2),
+            'avg_ms': round(row['total_ms'] / requests, 2),
+            'p50_ms': percentile(row['samples'], 50),
+            'p95_ms': percentile(row['samples'], 95),
+            'max_ms': row['max_ms'],
+        })
+    return sorted(rows, key=lambda row: row['p95_ms'], reverse=True)
+
+
+def reset_report():
+    cache.delete(REPORT_KEY)
@@ -0,0 +1,74 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+from .models import Product
+
+
+STOCK_BATCH_SIZE = 100
+
+
+# Результат списания: что списали и каких товаров не хватило
+@dataclass(frozen=True)
+class StockCommitResult:
+    committed: dict
+    oversold: dict
+
+    @property
+    def is_complete(self):
+        return not self.oversold
+
+
+# Списание остатков: один условный UPDATE на пачку товаров
+# UPDATE product SET quantity = quantity - n WHERE (id = 1 AND quantity >= n) OR ...
+# Если какого-то товара не хватило, пачка откатывается до savepoint и списывается
+# построчно, чтобы узнать, какие именно позиции перепроданы.
+def commit_stock(lines, batch_size=STOCK_BATCH_SIZE):
+    demand = get_demand(lines)
+    committed = {}
+    oversold = {}
+    items = list(demand.items())
+    with transaction.atomic():
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            savepoint = transaction.savepoint()
+            if update_stock_batch(batch) == len(batch):
+                transaction.savepoint_commit(savepoint)
+                committed.update(batch)
+                continue
+
+            transaction.savepoint_rollback(savepoint)
+            for product_id, quantity in batch:
+                if update_stock_batch([(product_id, quantity)]):
+                    committed[product_id] = quantity
+                else:
+                    oversold[product_id] = quantity
+
+    return StockCommitResult(committed=committed, oversold=oversold)
+
+
+# Проверка перед оплатой: товары, которых на складе меньше, чем в заказе - {product_id: сколько есть}.
+# Остатки не резервируются, окончательно их списывает commit_stock после оплаты
+def find_shortages(lines):
+    demand = get_demand(lines)
+    stock = dict(Product.objects.filter(pk__in=demand).values_list('pk', 'quantity'))
+    return {product_id: stock.get(product_id, 0) for product_id, quantity in demand.items()
+            if stock.get(product_id, 0) < quantity}
+
+
+def get_demand(lines):
+    demand = defaultdict(int)
+    for product_id, quantity in lines:
+        if product_id and quantity > 0:
+            demand[product_id] += quantity
+    return demand
+
+
+def update_stock_batch(batch):
+    condition = Q()
+    whens = []
+    for product_id, quantity in batch:
+        condition |= Q(pk=product_id, quantity__gte=quantity)
+        whens.append(When(pk=product_id, then=F('quantity') - quantity))
+
+    return Product.objects.filter(condition).update(quantity=Case(*whens, default=F('quantity')))
@@ -0,0 +1,133 @@
+import logging
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Job, Order, Product
+from .search import get_search_backend
+from .utils import finalize_order
+
+
+logger = logging.getLogger(__name__)
+
+JOB_MAX_ATTEMPTS = getattr(settings, 'LOFT_JOB_MAX_ATTEMPTS', 5)
+JOB_RETRY_DELAY = getattr(settings, 'LOFT_JOB_RETRY_DELAY', 30)  # секунд, растёт вдвое с каждой попыткой
+JOB_LOCK_TIMEOUT = getattr(settings, 'LOFT_JOB_LOCK_TIMEOUT', 10 * 60)  # Задачу упавшего воркера берём снова
+JOB_KEEP_DONE = getattr(settings, 'LOFT_JOB_KEEP_DONE', 60 * 60 * 24)
+
+handlers = {}
+
+
+# Регистрация обработчика: @job_handler('finalize_order'), обработчик получает payload задачи
+def job_handler(kind):
+    def decorator(func):
+        handlers[kind] = func
+        return func
+    return decorator
+
+
+# Постановка задачи в очередь в текущей транзакции: если транзакция откатится, задачи не будет.
+# Задача с тем же ключом идемпотентности ставится один раз. Возвращает (задача, создана ли она)
+def enqueue(kind, payload=None, key=None, run_after=None):
+    job = Job(kind=kind, payload=payload or {}, idempotency_key=key, run_after=run_after or timezone.now())
+    if key is None:
+        job.save()
+        return job, True
+    try:
+        with transaction.atomic():
+            job.save()
+        return job, True
+    except IntegrityError:
+        return Job.objects.get(idempotency_key=key), False
+
+
+# Захват следующей задачи условным UPDATE: из нескольких воркеров задачу получит только один
+def claim_job():
+    now = timezone.now()
+    ready = (Q(status=Job.PENDING, run_after__lte=now) |
+             Q(status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=JOB_LOCK_TIMEOUT)))
+    candidates = Job.objects.filter(ready).order_by('run_after', 'pk').values_list('pk', flat=True)[:10]
+    for pk in candidates:
+        claimed = Job.objects.filter(ready, pk=pk).update(status=Job.RUNNING, locked_at=now,
+                                                          attempts=F('attempts') + 1)
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+# Ошибка в обработчике - повтор позже, после JOB_MAX_ATTEMPTS попыток задача помечается как failed
+def run_job(job):
+    handler = handlers.get(job.kind)
+    try:
+        if handler is None:
+            raise LookupError(f'Нет обработчика для задачи "{job.kind}"')
+        handler(job.payload)
+    except Exception:
+        logger.exception('Задача %s #%s завершилась с ошибкой', job.kind, job.pk)
+        failed = job.attempts >= JOB_MAX_ATTEMPTS
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.FAILED if failed else Job.PENDING,
+            run_after=timezone.now() + timedelta(seconds=JOB_RETRY_DELAY * 2 ** (job.attempts - 1)),
+            locked_at=None,
+            last_error=traceback.format_exc(),
+            updated_at=timezone.now()
+        )
+        return False
+
+    Job.objects.filter(pk=job.pk).update(status=Job.DONE, locked_at=None, updated_at=timezone.now())
+    return True
+
+
+# Выполнить задачи, готовые к запуску. Возвращает число обработанных задач
+def run_pending_jobs(limit=None):
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_job()
+        if job is None:
+            break
+        run_job(job)
+        processed += 1
+    return processed
+
+
+# Удаление выполненных задач старше JOB_KEEP_DONE (вызывают воркеры, см. run_workers).
+# Упавшие задачи остаются для разбора. Повтор finalize_order после удаления ключа безопасен
+def purge_done_jobs():
+    expired = timezone.now() - timedelta(seconds=JOB_KEEP_DONE)
+    deleted, _ = Job.objects.filter(status=Job.DONE, updated_at__lt=expired).delete()
+    return deleted
+
+
+# ========================= Обработчики =========================
+
+# Оплата заказа подтверждена: отметка оплаты и списание остатков (utils.finalize_order).
+# finalize_order сам защищён от повторного списания, поэтому повтор задачи безопасен.
+@job_handler('finalize_order')
+def finalize_order_job(payload):
+    order = Order.objects.filter(pk=payload['order_id']).first()
+    if order is None:
+        logger.warning('Заказ №%s для оплаты не найден', payload['order_id'])
+        return
+    finalize_order(order)
+
+
+def enqueue_finalize_order(order_id):
+    return enqueue('finalize_order', {'order_id': order_id}, key=f'finalize_order:{order_id}')
+
+
+# Обновление поискового индекса вне запроса: товары читаются заново на момент выполнения,
+# удалённые к этому времени убираются из индекса. Повтор задачи безопасен
+@job_handler('index_products')
+def index_products_job(payload):
+    products = list(Product.objects.filter(pk__in=payload['ids']).select_related('model'))
+    backend = get_search_backend()
+    backend.index_products(products)
+    backend.remove_products(set(payload['ids']) - {product.pk for product in products})
+
+
+def enqueue_index_products(product_ids):
+    ids = sorted(set(product_ids))
+    if ids:
+        return enqueue('index_products', {'ids': ids})
@@ -0,0 +1,78 @@
+import heapq
+import math
+from collections import Counter, defaultdict
+from itertools import combinations
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from loft.cache import bump_version
+from loft.models import OrderProduct, ProductRecommendation
+
+
+# Расчёт рекомендаций "покупают вместе" по истории оплаченных заказов:
+# python manage.py build_recommendations --top-k 8
+# Матрица совместных покупок разреженная (словарь счётчиков), оценка пары -
+# косинусная мера co(a, b) / sqrt(n(a) * n(b)). Для каждого товара сохраняем top-K соседей.
+class Command(BaseCommand):
+    help = 'Строит таблицу рекомендаций "покупают вместе" по оплаченным заказам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=8)
+        parser.add_argument('--min-support', type=int, default=1, help='Минимум совместных покупок пары')
+        parser.add_argument('--max-order-size', type=int, default=50,
+                            help='Большие заказы пропускаем, чтобы число пар не росло квадратично')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        pairs, counts, skipped = self.count_pairs(options['max_order_size'])
+        rows = self.top_neighbours(pairs, counts, options['top_k'], options['min_support'])
+
+        with transaction.atomic():
+            ProductRecommendation.objects.all().delete()
+            ProductRecommendation.objects.bulk_create(rows, batch_size=options['batch_size'])
+        bump_version('catalog')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Товаров с рекомендациями: {len({row.product_id for row in rows})}, записей: {len(rows)}'
+        ))
+        if skipped:
+            self.stdout.write(f'Пропущено заказов больше {options["max_order_size"]} товаров: {skipped}')
+
+    # Проходим строки заказов потоком, отсортированными по заказу
+    def count_pairs(self, max_order_size):
+        lines = (OrderProduct.objects.filter(order__payment=True, product__isnull=False)
+                 .order_by('order_id').values_list('order_id', 'product_id').iterator(chunk_size=10000))
+
+        pairs = defaultdict(Counter)
+        counts = Counter()
+        current_order, basket, skipped = None, set(), 0
+        for order_id, product_id in lines:
+            if order_id != current_order:
+                skipped += not self.add_basket(basket, pairs, counts, max_order_size)
+                current_order, basket = order_id, set()
+            basket.add(product_id)
+        skipped += not self.add_basket(basket, pairs, counts, max_order_size)
+        return pairs, counts, skipped
+
+    # Заказ больше max_order_size пропускаем целиком: обрезка по id смещала бы
+    # статистику в пользу старых товаров, а такие заказы обычно оптовые и мало говорят о связях
+    @staticmethod
+    def add_basket(basket, pairs, counts, max_order_size):
+        if len(basket) > max_order_size:
+            return False
+        items = sorted(basket)
+        counts.update(items)
+        for a, b in combinations(items, 2):
+            pairs[a][b] += 1
+            pairs[b][a] += 1
+        return True
+
+    @staticmethod
+    def top_neighbours(pairs, counts, top_k, min_support):
+        rows = []
+        for product_id, neighbours in pairs.items():
+            scored = ((together / math.sqrt(counts[product_id] * counts[other]), other)
+                      for other, together in neighbours.items() if together >= min_support)
+            for rank, (score, other) in enumerate(heapq.nlargest(top_k, scored), start=1):
+                rows.append(ProductRecommendation(product_id=product_id, recommended_id=other,
+                                                  score=score, rank=rank))
+        return rows
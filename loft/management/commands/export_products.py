@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from loft.feeds import FeedError, get_format, write_rows, export_rows
+from loft.models import Product
+
+
+# Выгрузка товаров в CSV или JSONL в формате import_products:
+# python manage.py export_products products.jsonl
+class Command(BaseCommand):
+    help = 'Выгружает товары в CSV/JSONL файл'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='Путь к файлу, по умолчанию stdout')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='По умолчанию - по расширению файла')
+        parser.add_argument('--category', help='Только товары подкатегории или категории с этим слагом')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            fmt = get_format(path, options['format'] or ('csv' if path == '-' else None))
+        except FeedError as error:
+            raise CommandError(error)
+
+        products = Product.objects.all()
+        if options['category']:
+            products = products.filter(Q(category__slug=options['category']) |
+                                       Q(category__parent__slug=options['category']))
+
+        if path == '-':
+            write_rows(self.stdout, fmt, export_rows(products, options['chunk_size']))
+            return
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            write_rows(file, fmt, export_rows(products, options['chunk_size']))
+        self.stderr.write(self.style.SUCCESS(f'Товары выгружены в {path}'))
@@ -0,0 +1,161 @@
+import random
+from io import BytesIO
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from PIL import Image
+from loft.cache import bump_version
+from loft.models import (Category, Product, ProductModel, ImageProduct, FavoriteProduct, Customer, Order,
+                         OrderProduct, Region, City)
+from loft.search import get_search_backend
+
+
+PREFIX = 'bench'
+PLACEHOLDER_IMAGE = f'images/{PREFIX}-placeholder.jpg'
+COLORS = [('Белый', '#ffffff'), ('Чёрный', '#000000'), ('Серый', '#808080'), ('Бежевый', '#f5f5dc'),
+          ('Синий', '#1e3a8a'), ('Зелёный', '#166534'), ('Коричневый', '#78350f'), ('Красный', '#b91c1c')]
+WORDS = ['Диван', 'Кресло', 'Стол', 'Стул', 'Шкаф', 'Кровать', 'Комод', 'Тумба', 'Полка', 'Пуф']
+ADJECTIVES = ['угловой', 'мягкий', 'лофт', 'складной', 'обеденный', 'раскладной', 'модульный', 'дубовый']
+
+
+# Генерация большого тестового каталога для замеров скорости:
+# python manage.py generate_catalog --products 100000 --users 1000 --orders 5000
+class Command(BaseCommand):
+    help = 'Создаёт синтетический каталог, пользователей, избранное и заказы для бенчмарков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=10, help='Категорий верхнего уровня')
+        parser.add_argument('--subcategories', type=int, default=5, help='Подкатегорий в каждой категории')
+        parser.add_argument('--models', type=int, default=100)
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--images', type=int, default=3, help='Фото на товар')
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--favorites', type=int, default=10, help='Избранных товаров на пользователя')
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--lines', type=int, default=4, help='Максимум товаров в заказе')
+        parser.add_argument('--regions', type=int, default=10)
+        parser.add_argument('--cities', type=int, default=20, help='Городов в регионе')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--clear', action='store_true', help='Удалить ранее сгенерированные данные')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+
+        if options['clear']:
+            self.clear()
+
+        with transaction.atomic():
+            subcategories = self.create_categories(options['categories'], options['subcategories'])
+            models = self.create_models(options['models'])
+            products = self.create_products(options['products'], subcategories, models)
+            self.create_images(products, options['images'])
+            users = self.create_users(options['users'])
+            self.create_favorites(users, products, options['favorites'])
+            self.create_orders(users, products, options['orders'], options['lines'])
+            self.create_regions(options['regions'], options['cities'])
+
+        # bulk_create не вызывает сигналы - обновляем производные данные сами
+        Order.objects.filter(customer__user__username__startswith=f'{PREFIX}-').update_totals()
+        get_search_backend().rebuild()
+        bump_version('category_tree')
+        bump_version('catalog')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: {len(subcategories)} подкатегорий, {len(products)} товаров, {len(users)} пользователей'
+        ))
+
+    def clear(self):
+        Order.objects.filter(customer__user__username__startswith=f'{PREFIX}-').delete()
+        OrderProduct.objects.filter(order__isnull=True).delete()
+        Customer.objects.filter(user__username__startswith=f'{PREFIX}-').delete()
+        User.objects.filter(username__startswith=f'{PREFIX}-').delete()
+        Category.objects.filter(slug__startswith=f'{PREFIX}-').delete()
+        ProductModel.objects.filter(title__startswith=f'{PREFIX} ').delete()
+        Region.objects.filter(title__startswith=f'{PREFIX} ').delete()
+
+    def bulk_create(self, model, objects):
+        return model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def create_categories(self, count, sub_count):
+        parents = self.bulk_create(Category, [
+            Category(title=f'Категория {i}', slug=f'{PREFIX}-category-{i}') for i in range(count)
+        ])
+        return self.bulk_create(Category, [
+            Category(title=f'Подкатегория {i}-{j}', slug=f'{PREFIX}-category-{i}-{j}', parent=parent)
+            for i, parent in enumerate(parents) for j in range(sub_count)
+        ])
+
+    def create_models(self, count):
+        return self.bulk_create(ProductModel, [ProductModel(title=f'{PREFIX} Модель {i}') for i in range(count)])
+
+    def create_products(self, count, subcategories, models):
+        products = []
+        for i in range(count):
+            color_name, color_code = self.rng.choice(COLORS)
+            title = f'{self.rng.choice(WORDS)} {self.rng.choice(ADJECTIVES)} {i}'
+            products.append(Product(
+                title=title,
+                description=f'{title}. Цвет: {color_name.lower()}. Отличная мебель в стиле лофт.',
+                price=self.rng.randrange(500, 100000, 100),
+                quantity=self.rng.randint(0, 50),
+                color_name=color_name,
+                color_code=color_code,
+                width=str(self.rng.randint(40, 300)),
+                depth=str(self.rng.randint(40, 200)),
+                height=str(self.rng.randint(40, 220)),
+                discount=self.rng.choice([None] * 4 + [5, 10, 15, 20, 30]),
+                category=self.rng.choice(subcategories),
+                model=self.rng.choice(models) if models else None,
+                slug=f'{PREFIX}-product-{i}'
+            ))
+        return self.bulk_create(Product, products)
+
+    # У всех товаров одна и та же картинка-заглушка, файлы не плодим
+    def create_images(self, products, per_product):
+        if not default_storage.exists(PLACEHOLDER_IMAGE):
+            buffer = BytesIO()
+            Image.new('RGB', (1200, 800), (200, 190, 180)).save(buffer, format='JPEG')
+            default_storage.save(PLACEHOLDER_IMAGE, ContentFile(buffer.getvalue()))
+
+        self.bulk_create(ImageProduct, [
+            ImageProduct(product=product, image=PLACEHOLDER_IMAGE) for product in products for _ in range(per_product)
+        ])
+
+    def create_users(self, count):
+        password = make_password('benchmark')
+        return self.bulk_create(User, [
+            User(username=f'{PREFIX}-user-{i}', first_name=f'Покупатель {i}', password=password) for i in range(count)
+        ])
+
+    def create_favorites(self, users, products, per_user):
+        per_user = min(per_user, len(products))
+        self.bulk_create(FavoriteProduct, [
+            FavoriteProduct(user=user, product=product)
+            for user in users for product in self.rng.sample(products, per_user)
+        ])
+
+    # У каждого пользователя есть незакрытая корзина, остальные заказы оплачены
+    def create_orders(self, users, products, count, max_lines):
+        if not users or not products:
+            return
+        customers = self.bulk_create(Customer, [Customer(user=user) for user in users])
+        orders = [Order(customer=customer, payment=False) for customer in customers]
+        orders += [Order(customer=self.rng.choice(customers), payment=True) for _ in range(count)]
+        orders = self.bulk_create(Order, orders)
+
+        lines = []
+        for order in orders:
+            for product in self.rng.sample(products, min(self.rng.randint(1, max_lines), len(products))):
+                lines.append(OrderProduct(order=order, product=product, quantity=self.rng.randint(1, 3)))
+        self.bulk_create(OrderProduct, lines)
+
+    def create_regions(self, count, cities):
+        regions = self.bulk_create(Region, [Region(title=f'{PREFIX} Регион {i}') for i in range(count)])
+        self.bulk_create(City, [
+            City(title=f'Город {i}-{j}', region=region) for i, region in enumerate(regions) for j in range(cities)
+        ])
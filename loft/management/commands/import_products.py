@@ -0,0 +1,46 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from loft.cache import bump_version
+from loft.feeds import FeedError, get_format, read_rows, import_products
+
+
+# Загрузка товаров из CSV или JSONL (колонки - см. loft/feeds.py FIELDS):
+# python manage.py import_products supplier.csv --batch-size 2000
+# Товары ищутся по slug: найденные обновляются, остальные создаются.
+# Колонки, которых нет в файле, у существующих товаров не меняются.
+class Command(BaseCommand):
+    help = 'Загружает товары из CSV/JSONL файла пачками (обновление по slug)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу или "-" для stdin')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='По умолчанию - по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--no-create-models', action='store_true',
+                            help='Не создавать отсутствующие модели, а пропускать такие строки')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            fmt = get_format(path, options['format'] or ('csv' if path == '-' else None))
+        except FeedError as error:
+            raise CommandError(error)
+
+        file = sys.stdin if path == '-' else open(path, encoding='utf-8-sig', newline='')
+        try:
+            result = import_products(read_rows(file, fmt), options['batch_size'],
+                                     create_models=not options['no_create_models'])
+        except (FeedError, ValueError) as error:
+            raise CommandError(f'Ошибка чтения файла: {error}')
+        finally:
+            if file is not sys.stdin:
+                file.close()
+            # Уже загруженные пачки видны сразу, даже если файл оборвался на середине
+            bump_version('catalog')
+
+        for line_num, message in result.errors[:50]:
+            self.stderr.write(f'Строка {line_num}: {message}')
+        if len(result.errors) > 50:
+            self.stderr.write(f'... и ещё {len(result.errors) - 50} ошибок')
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: {result.created}, обновлено: {result.updated}, пропущено: {len(result.errors)}'
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from loft.models import Order
+
+
+# Команда для пересчёта сохранённых сумм заказов: python manage.py rebuild_order_totals
+class Command(BaseCommand):
+    help = 'Пересчитывает total_price и total_quantity у заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--unpaid', action='store_true', help='Только неоплаченные корзины')
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        if options['unpaid']:
+            orders = orders.filter(payment=False, awaiting_payment=False)
+
+        updated = orders.update_totals()
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано заказов: {updated}'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from loft.search import get_search_backend
+
+
+# Полная переиндексация товаров: python manage.py rebuild_search_index
+class Command(BaseCommand):
+    help = 'Перестраивает поисковый индекс товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Индекс перестроен ({backend.__class__.__name__})'))
@@ -0,0 +1,154 @@
+import json
+import statistics
+import time
+from pathlib import Path
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from loft.cache import bump_version
+from loft.models import Category, Product, Order
+
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmark_baseline.json'
+
+
+# Замер основных страниц через тестовый клиент Django: p50/p95 и число SQL запросов.
+# Сравнивает результат с сохранёнными значениями и падает при регрессии.
+# Анонимные страницы замеряются дважды: без кэша страниц (основное значение, ловит регрессии
+# запросов и шаблонов) и из кэша (строка "<сценарий>:warm").
+# Данные для замеров: python manage.py generate_catalog
+class Command(BaseCommand):
+    help = 'Бенчмарк основных страниц магазина с проверкой по сохранённым базовым значениям'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help='JSON файл с базовыми значениями')
+        parser.add_argument('--update-baseline', action='store_true', help='Сохранить результаты как базовые')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Допустимый рост p95 (0.25 = 25%%)')
+        parser.add_argument('--min-delta-ms', type=float, default=5.0, help='Рост p95 меньше этого не считается')
+        parser.add_argument('--host', help='Имя хоста для запросов (по умолчанию из ALLOWED_HOSTS)')
+        parser.add_argument('--username', default='bench-user-0', help='Пользователь для корзины и оформления')
+        parser.add_argument('--only', nargs='*', help='Запустить только эти сценарии')
+
+    def handle(self, *args, **options):
+        scenarios = self.get_scenarios(options['username'])
+        if options['only']:
+            scenarios = [scenario for scenario in scenarios if scenario[0] in options['only']]
+        if not scenarios:
+            raise CommandError('Нет данных для замеров, сначала запустите generate_catalog')
+
+        host = options['host'] or next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'),
+                                       'localhost')
+        results = {}
+        for name, url, user in scenarios:
+            # Страницы авторизованных пользователей кэш не использует, для них один замер
+            runs = [(name, False)] if user else [(name, False), (f'{name}:warm', True)]
+            for result_name, warm in runs:
+                results[result_name] = row = self.measure(url, user, host, options['iterations'],
+                                                          options['warmup'], warm)
+                self.stdout.write(f'{result_name:<32} p50 {row["p50_ms"]:>8.2f} мс   '
+                                  f'p95 {row["p95_ms"]:>8.2f} мс   SQL {row["queries"]:>4}   статус {row["status"]}')
+
+        baseline_path = Path(options['baseline'])
+        if options['update_baseline']:
+            baseline_path.write_text(json.dumps(results, indent=2, ensure_ascii=False))
+            self.stdout.write(self.style.SUCCESS(f'Базовые значения сохранены в {baseline_path}'))
+            return
+
+        if not baseline_path.exists():
+            self.stdout.write(self.style.WARNING(f'{baseline_path} не найден, сравнивать не с чем '
+                                                 f'(сохраните значения через --update-baseline)'))
+            return
+
+        regressions = self.compare(results, json.loads(baseline_path.read_text()),
+                                   options['tolerance'], options['min_delta_ms'])
+        if regressions:
+            raise CommandError('Регрессии производительности:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
+
+    # Сценарии: (название, url, пользователь или None)
+    def get_scenarios(self, username):
+        scenarios = [('main', reverse('main'), None)]
+
+        category = (Category.objects.filter(parent=None).annotate(count=Count('subcategories__products'))
+                    .order_by('-count').first())
+        if category:
+            url = reverse('category', kwargs={'slug': category.slug})
+            product = Product.objects.filter(category__parent=category).select_related('category', 'model').first()
+            scenarios += [
+                ('category', url, None),
+                ('category:page_10', f'{url}?page=10', None),
+                ('category:cursor', f'{url}?cursor=', None),
+                ('category:price', f'{url}?from=1000&till=50000', None),
+            ]
+            if product:
+                scenarios += [
+                    ('category:color', f'{url}?color_name={product.color_name}', None),
+                    ('category:sub_model', f'{url}?sub={product.category.title}'
+                                           f'&model={product.model.title if product.model else ""}', None),
+                    ('product', product.get_absolute_url(), None),
+                ]
+
+        scenarios.append(('sales', reverse('sales'), None))
+
+        user = User.objects.filter(username=username).first()
+        if user and Order.objects.filter(customer__user=user, payment=False, orderproduct__isnull=False).exists():
+            scenarios += [
+                ('my_cart', reverse('my_cart'), user),
+                ('checkout', reverse('checkout'), user),
+            ]
+        return scenarios
+
+    # warm=False: кэш страниц выключен (таймаут 0) и прежние записи сброшены версией каталога,
+    # каждый запрос строит страницу заново. Остальные кэши (дерево категорий и т.п.) работают как обычно
+    def measure(self, url, user, host, iterations, warmup, warm=True):
+        if warm:
+            return self.run_requests(url, user, host, iterations, warmup)
+        bump_version('catalog')
+        with override_settings(LOFT_PAGE_CACHE_TIMEOUT=0):
+            return self.run_requests(url, user, host, iterations, warmup)
+
+    def run_requests(self, url, user, host, iterations, warmup):
+        client = Client(SERVER_NAME=host, raise_request_exception=False)
+        if user:
+            client.force_login(user)
+
+        for _ in range(warmup):
+            client.get(url)
+
+        timings = []
+        query_counts = []
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - start) * 1000)
+            query_counts.append(len(queries))
+
+        timings.sort()
+        return {
+            'p50_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(timings[min(len(timings) - 1, round(0.95 * (len(timings) - 1)))], 2),
+            'queries': max(query_counts),
+            'status': response.status_code
+        }
+
+    def compare(self, results, baseline, tolerance, min_delta_ms):
+        regressions = []
+        for name, row in results.items():
+            if row['status'] >= 500:
+                regressions.append(f'{name}: ответ со статусом {row["status"]}')
+            expected = baseline.get(name)
+            if not expected:
+                continue
+            if row['queries'] > expected['queries']:
+                regressions.append(f'{name}: SQL запросов {row["queries"]}, было {expected["queries"]}')
+            if row['p95_ms'] > max(expected['p95_ms'] * (1 + tolerance), expected['p95_ms'] + min_delta_ms):
+                regressions.append(f'{name}: p95 {row["p95_ms"]} мс, было {expected["p95_ms"]} мс')
+        return regressions
@@ -0,0 +1,64 @@
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from django.core.management.base import BaseCommand
+from django.db import connections
+from loft.jobs import purge_done_jobs, run_pending_jobs
+
+
+PURGE_INTERVAL = 60 * 10  # Как часто воркер удаляет выполненные задачи, секунд
+
+
+# Воркеры фоновых задач (loft/jobs.py):
+# python manage.py run_workers --processes 4
+# --once обрабатывает накопившиеся задачи и завершается (удобно для cron и тестов)
+class Command(BaseCommand):
+    help = 'Запускает воркеры очереди фоновых задач'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2, help='Число процессов, 0 - в текущем процессе')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Пауза при пустой очереди, секунд')
+        parser.add_argument('--once', action='store_true', help='Выйти, когда очередь опустеет')
+
+    def handle(self, *args, **options):
+        if options['processes'] <= 0:
+            processed = work(options['sleep'], options['once'])
+            self.stdout.write(self.style.SUCCESS(f'Выполнено задач: {processed}'))
+            return
+
+        # Соединения с базой не должны переходить в дочерние процессы
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['processes'], initializer=init_worker) as pool:
+            futures = [pool.submit(work, options['sleep'], options['once']) for _ in range(options['processes'])]
+            try:
+                wait(futures)
+            except KeyboardInterrupt:
+                # SIGINT получает вся группа процессов, воркеры доделают текущие задачи и выйдут
+                self.stdout.write('Остановка воркеров...')
+                wait(futures)
+        processed = sum(future.result() for future in futures)
+        self.stdout.write(self.style.SUCCESS(f'Выполнено задач: {processed}'))
+
+
+def init_worker():
+    connections.close_all()
+
+
+def work(sleep, once):
+    processed = 0
+    stopping = []
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stopping.append(True))
+    purged_at = None
+    while not stopping:
+        count = run_pending_jobs(limit=10)
+        processed += count
+        if not count:
+            if purged_at is None or time.monotonic() - purged_at >= PURGE_INTERVAL:
+                purge_done_jobs()
+                purged_at = time.monotonic()
+            if once:
+                break
+            time.sleep(sleep)
+    connections.close_all()
+    return processed
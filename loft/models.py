@@ -1,17 +1,41 @@
 from django.db import models
+from django.db.models import F, Q, ExpressionWrapper, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 
 # Create your models here.
 
-class Category(models.Model):
+# Методы для уменьшенных копий картинки (см. renditions.py)
+class RenditionMixin:
+    rendition_field = None
+
+    def get_renditions(self):
+        from .renditions import get_current_renditions
+        return get_current_renditions(self.renditions, getattr(self, self.rendition_field))
+
+    def get_rendition_url(self, width, fmt='webp'):
+        from .renditions import get_rendition_url
+        field_file = getattr(self, self.rendition_field)
+        return get_rendition_url(self.get_renditions(), width, fmt, field_file.url if field_file else '')
+
+    def get_srcset(self, fmt='webp'):
+        from .renditions import get_srcset
+        return get_srcset(self.get_renditions(), fmt)
+
+
+class Category(RenditionMixin, models.Model):
     title = models.CharField(max_length=150, verbose_name='Название категории')
     icon = models.ImageField(upload_to='icons/', null=True, blank=True, verbose_name='Иконка категории')
     slug = models.SlugField(unique=True, null=True, verbose_name='Слаг категории')
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True,
                                related_name='subcategories',
                                verbose_name='Категория')
+    renditions = models.JSONField(default=dict, blank=True, editable=False, verbose_name='Миниатюры иконки')
+
+    rendition_field = 'icon'
 
     def get_absolute_url(self):
         return reverse('category', kwargs={'slug': self.slug})
@@ -30,6 +54,23 @@ class Category(models.Model):
         verbose_name_plural = 'Категории'
 
 
+class ProductQuerySet(models.QuerySet):
+    # Товары по акции (раньше фильтровали в Python по i.discount)
+    def on_sale(self):
+        return self.filter(discount__gt=0)
+
+    # Цена со скидкой считается в базе, как в OrderProduct.get_total_price
+    def with_sale_price(self):
+        return self.annotate(sale_price=ExpressionWrapper(
+            F('price') - F('price') * F('discount') / 100.0,
+            output_field=models.FloatField()
+        ))
+
+    # Фото товаров одним запросом на всю страницу, get_first_photo берёт их из prefetch
+    def with_images(self):
+        return self.prefetch_related(Prefetch('images', queryset=ImageProduct.objects.order_by('pk')))
+
+
 class Product(models.Model):
     title = models.CharField(max_length=250, verbose_name='Название товара')
     description = models.TextField(verbose_name='Описание товара')
@@ -45,16 +86,24 @@ class Product(models.Model):
                                  related_name='products', verbose_name='Категория')
     model = models.ForeignKey('ProductModel', on_delete=models.CASCADE, blank=True, null=True, verbose_name='Модель')
     slug = models.SlugField(unique=True, null=True, verbose_name='Слаг категории')
-    created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True, verbose_name='Дата добавления')
+    # NOT NULL: по (created_at, pk) работает keyset пагинация каталога (pagination.py)
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата добавления')
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True, verbose_name='Дата изменения')
 
+    objects = ProductQuerySet.as_manager()
 
     def get_absolute_url(self):
         return reverse('product', kwargs={'slug': self.slug})
 
+    # Если фото загружены через with_images(), запроса к базе не будет
+    def get_first_image(self):
+        images = self.images.all()[:1]
+        return images[0] if images else None
+
     def get_first_photo(self):
-        if self.images:
-            return self.images.first().image.url
+        image = self.get_first_image()
+        if image:
+            return image.image.url
         else:
             return '-'
 
@@ -65,13 +114,21 @@ class Product(models.Model):
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
+        indexes = [
+            models.Index(fields=['category', 'price']),  # Фильтр по цене внутри категории
+            models.Index(fields=['color_name']),
+            models.Index(fields=['-created_at'], condition=Q(discount__gt=0), name='product_on_sale_idx'),
+        ]
 
 
 
-class ImageProduct(models.Model):
+class ImageProduct(RenditionMixin, models.Model):
     image = models.ImageField(upload_to='images/', verbose_name='Фото товара')
     product = models.ForeignKey(Product, on_delete=models.CASCADE,
                                 related_name='images', verbose_name='Товар')
+    renditions = models.JSONField(default=dict, blank=True, editable=False, verbose_name='Миниатюры')
+
+    rendition_field = 'image'
 
 
     def __str__(self):
@@ -80,6 +137,7 @@ class ImageProduct(models.Model):
     class Meta:
         verbose_name = 'Фото товара'
         verbose_name_plural = 'Фото товаров'
+        ordering = ['pk']  # Первое фото товара - обложка
 
 
 
@@ -93,9 +151,33 @@ class ProductModel(models.Model):
     class Meta:
         verbose_name = 'Модель'
         verbose_name_plural = 'Модели'
+        indexes = [
+            models.Index(fields=['title']),  # Фильтр товаров по model__title
+        ]
+
 
 
 
+# Товары, которые покупают вместе (заполняет команда build_recommendations)
+class ProductRecommendation(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations',
+                                verbose_name='Товар')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+',
+                                    verbose_name='Рекомендуемый товар')
+    score = models.FloatField(verbose_name='Оценка')
+    rank = models.PositiveSmallIntegerField(verbose_name='Место')
+
+    def __str__(self):
+        return f'{self.product_id} -> {self.recommended_id} ({self.score:.3f})'
+
+    class Meta:
+        verbose_name = 'Рекомендация'
+        verbose_name_plural = 'Покупают вместе'
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_recommendation_rank'),
+        ]
+
 
 class FavoriteProduct(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Пользователь')
@@ -108,6 +190,9 @@ class FavoriteProduct(models.Model):
     class Meta:
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранные товары'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_favorite_product'),
+        ]
 
 
 
@@ -124,12 +209,35 @@ class Customer(models.Model):
         verbose_name_plural = 'Покупатели'
 
 
+class OrderQuerySet(models.QuerySet):
+    # Пересчёт сумм заказов одним UPDATE с подзапросами по товарам заказа.
+    # Строки удалённых товаров (product = NULL) не считаются - их нет и в load_cart
+    def update_totals(self):
+        lines = OrderProduct.objects.filter(order=OuterRef('pk'), product__isnull=False).order_by().values('order')
+        price = F('product__price') - F('product__price') * Coalesce(F('product__discount'), 0) / 100.0
+        total_price = lines.annotate(total=Sum(F('quantity') * price)).values('total')
+        total_quantity = lines.annotate(total=Sum('quantity')).values('total')
+
+        return self.update(
+            total_price=Coalesce(Subquery(total_price, output_field=models.FloatField()), Value(0.0)),
+            total_quantity=Coalesce(Subquery(total_quantity, output_field=models.IntegerField()), Value(0))
+        )
+
+
 class Order(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, verbose_name='Покупатель')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата заказа')
     is_completed = models.BooleanField(default=False, verbose_name='Статус заказа')
     payment = models.BooleanField(default=False, verbose_name='Статус оплаты')
     shipping = models.BooleanField(default=True, verbose_name='Доставка')
+    # Заказ передан на оплату: состав больше не меняется, покупатель получает новую корзину
+    awaiting_payment = models.BooleanField(default=False, verbose_name='Ожидает оплаты')
+    payment_started_at = models.DateTimeField(null=True, blank=True, verbose_name='Передан на оплату')
+    # Суммы хранятся в заказе и пересчитываются при изменении OrderProduct (см. signals.py)
+    total_price = models.FloatField(default=0, verbose_name='Сумма заказа')
+    total_quantity = models.IntegerField(default=0, verbose_name='Количество товаров')
+
+    objects = OrderQuerySet.as_manager()
 
     def __str__(self):
         return f'Номер заказа: {self.pk}, на имя: {self.customer.user.username}'
@@ -138,19 +246,20 @@ class Order(models.Model):
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
 
-    # Методы для подсчёта суммы заказа и кол-ва товаров
+    # Методы для получения суммы заказа и кол-ва товаров (без запросов к товарам заказа)
     @property
     def get_order_total_price(self):
-        order_products = self.orderproduct_set.all() # Получаем заказанные товарвы Заказа по оброзу класса привязки
-        total_price = sum([i.get_total_price for i in order_products])  # [10 000, 10 0000, 20 0000]
-        return total_price
+        return self.total_price
 
 
     @property
     def get_order_total_quantity(self):
-        order_products = self.orderproduct_set.all()
-        total_quantity = sum([i.quantity for i in order_products])  # [2, 1, 1]
-        return total_quantity
+        return self.total_quantity
+
+    # Пересчитать суммы и обновить их в объекте
+    def refresh_totals(self):
+        Order.objects.filter(pk=self.pk).update_totals()
+        self.refresh_from_db(fields=['total_price', 'total_quantity'])
 
 
 class OrderProduct(models.Model):
@@ -167,15 +276,19 @@ class OrderProduct(models.Model):
     class Meta:
         verbose_name = 'Заказанный товар'
         verbose_name_plural = 'Заказанные товары'
+        constraints = [
+            # Один товар - одна строка заказа, количество меняется в ней (см. cart.py)
+            models.UniqueConstraint(fields=['order', 'product'], name='unique_order_product'),
+        ]
 
     # Метод для получения уммы заказа в количестве
     @property
     def get_total_price(self):
+        price = self.product.price
         if self.product.discount:
-            sun_proc = (self.product.price * self.product.discount) / 100
-            self.product.price -= sun_proc
+            price -= (price * self.product.discount) / 100
 
-        return self.product.price * self.quantity
+        return price * self.quantity
 
 
     def total_price(self):
@@ -199,6 +312,10 @@ class ShippingAddress(models.Model):
     class Meta:
         verbose_name = 'Адрес доставки'
         verbose_name_plural = 'Адреса доставок'
+        constraints = [
+            # Один адрес на заказ, повторное оформление обновляет его (см. save_shipping_address)
+            models.UniqueConstraint(fields=['order'], name='unique_shipping_address_order'),
+        ]
 
 
 
@@ -226,8 +343,37 @@ class City(models.Model):
         verbose_name_plural = 'Города'
 
 
+# Фоновая задача (см. jobs.py). Выполняется командой run_workers
+class Job(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    kind = models.CharField(max_length=50, verbose_name='Тип задачи')
+    payload = models.JSONField(default=dict, blank=True, verbose_name='Параметры')
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING, verbose_name='Статус')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')
+    idempotency_key = models.CharField(max_length=200, unique=True, null=True, blank=True,
+                                       verbose_name='Ключ идемпотентности')
+    run_after = models.DateTimeField(default=timezone.now, verbose_name='Выполнить после')
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name='Взята в работу')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
 
+    def __str__(self):
+        return f'{self.kind} #{self.pk} ({self.status})'
 
-
-
-
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            models.Index(fields=['status', 'run_after']),  # Выбор следующей задачи воркером
+        ]
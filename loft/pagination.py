@@ -0,0 +1,135 @@
+import base64
+import datetime
+import json
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+# Страница keyset пагинации: знает только соседние курсоры, COUNT(*) не нужен
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+# Пагинация по ключу сортировки: WHERE (created_at, pk) < (...) LIMIT n.
+# Глубокие страницы стоят столько же, сколько первая.
+# Поля сортировки должны быть NOT NULL (NULL не сравнивается через < и >, такие строки
+# выпали бы из выдачи), последним полем должен идти pk.
+class KeysetPaginator:
+    def __init__(self, queryset, per_page, ordering=('-created_at', '-pk')):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+
+    def page(self, cursor=None):
+        direction, values = self.decode_cursor(cursor) if cursor else ('next', None)
+        reverse = direction == 'prev'
+
+        queryset = self.queryset.order_by(*self.get_ordering(reverse))
+        if values is not None:
+            queryset = queryset.filter(self.get_filter(values, reverse))
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        if not rows:
+            return KeysetPage(rows)
+
+        has_next = has_more if not reverse else True
+        has_previous = values is not None if not reverse else has_more
+
+        next_cursor = self.encode_cursor('next', rows[-1]) if has_next else None
+        previous_cursor = self.encode_cursor('prev', rows[0]) if has_previous else None
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+    def get_ordering(self, reverse=False):
+        if not reverse:
+            return self.ordering
+        return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering)
+
+    # (f1 > v1) OR (f1 = v1 AND f2 > v2) OR ... с учётом направления сортировки
+    def get_filter(self, values, reverse=False):
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def get_field(self, name):
+        meta = self.queryset.model._meta
+        return meta.pk if name == 'pk' else meta.get_field(name)
+
+    def encode_cursor(self, direction, obj):
+        values = [getattr(obj, field.lstrip('-')) for field in self.ordering]
+        data = json.dumps({'d': direction, 'v': values}, default=self.encode_value)
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    # DjangoJSONEncoder обрезает микросекунды, а курсору нужно точное значение
+    @staticmethod
+    def encode_value(value):
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        return str(value)
+
+    def decode_cursor(self, cursor):
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            data = json.loads(data)
+            direction, values = data['d'], data['v']
+            if direction not in ('next', 'prev') or not isinstance(values, list) or \
+                    len(values) != len(self.ordering):
+                raise InvalidCursor(cursor)
+            values = [self.get_field(field.lstrip('-')).to_python(value)
+                      for field, value in zip(self.ordering, values)]
+            if None in values:  # Ключ сортировки NOT NULL, такой курсор подделан
+                raise InvalidCursor(cursor)
+        except (ValueError, TypeError, KeyError, ValidationError) as error:
+            raise InvalidCursor(cursor) from error
+        return direction, values
+
+
+# Миксин для ListView: keyset режим включается параметром ?cursor=,
+# без него работает обычная пагинация по номеру страницы
+class KeysetPaginationMixin:
+    keyset_ordering = ('-created_at', '-pk')
+    cursor_param = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.cursor_param not in self.request.GET:
+            return super().paginate_queryset(queryset, page_size)
+
+        paginator = KeysetPaginator(queryset, page_size, self.keyset_ordering)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_param))
+        except InvalidCursor:
+            raise Http404('Неверный курсор страницы')
+        return paginator, page, page.object_list, page.has_other_pages()
@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+import uuid
+from dataclasses import dataclass
+from functools import lru_cache
+from urllib.parse import urlencode
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+import stripe
+
+
+PAYMENT_TIMEOUT = getattr(settings, 'LOFT_PAYMENT_TIMEOUT', 10)
+PAYMENT_MAX_RETRIES = getattr(settings, 'LOFT_PAYMENT_MAX_RETRIES', 2)
+
+
+class PaymentError(Exception):
+    pass
+
+
+# Время жизни страницы оплаты, секунд
+def get_session_timeout():
+    return getattr(settings, 'LOFT_PAYMENT_SESSION_TIMEOUT', 60 * 60)
+
+
+@dataclass(frozen=True)
+class CheckoutSession:
+    id: str
+    url: str
+
+
+# Уведомление об оплате заказа, разобранное из вебхука
+@dataclass(frozen=True)
+class PaymentEvent:
+    order_id: int
+    paid: bool
+
+
+# Платёжный шлюз: создаёт страницу оплаты заказа и проверяет уведомления об оплате.
+# Реализация выбирается настройкой LOFT_PAYMENT_GATEWAY
+class PaymentGateway:
+    async def create_checkout_session(self, order_id, amount, success_url, cancel_url):
+        raise NotImplementedError
+
+    # Проверка подписи вебхука. Возвращает PaymentEvent или None, если событие не об оплате.
+    # При неверной подписи или формате - PaymentError
+    def parse_webhook(self, payload, headers):
+        raise NotImplementedError
+
+
+# Stripe через один клиент на процесс: соединения переиспользуются (keep-alive),
+# у запросов есть таймаут, сетевые ошибки повторяются max_network_retries раз.
+# С httpx запросы асинхронные, без него синхронный клиент requests работает в отдельном потоке.
+class StripeGateway(PaymentGateway):
+    currency = 'rub'
+
+    def __init__(self, api_key=None, timeout=PAYMENT_TIMEOUT, max_retries=PAYMENT_MAX_RETRIES):
+        try:
+            http_client = stripe.HTTPXClient(timeout=timeout, allow_sync_methods=True)
+            self.native_async = True
+        except ImportError:
+            http_client = stripe.RequestsClient(timeout=timeout)
+            self.native_async = False
+
+        self.client = stripe.StripeClient(api_key or settings.STRIPE_SECRET_KEY,
+                                          max_network_retries=max_retries, http_client=http_client)
+
+    async def create_checkout_session(self, order_id, amount, success_url, cancel_url):
+        params = {
+            'line_items': [{
+                'price_data': {
+                    'currency': self.currency,
+                    'product_data': {'name': 'Товары магазина LOFT'},
+                    'unit_amount': amount
+                },
+                'quantity': 1
+            }],
+            'mode': 'payment',
+            'client_reference_id': str(order_id),
+            'metadata': {'order_id': str(order_id)},
+            'success_url': success_url,
+            'cancel_url': cancel_url,
+            # После этого оплатить заказ нельзя, и он возвращается в корзину (utils.release_stale_payments)
+            'expires_at': int(time.time()) + get_session_timeout(),
+        }
+        sessions = self.client.v1.checkout.sessions
+        try:
+            if self.native_async:
+                session = await sessions.create_async(params)
+            else:
+                session = await sync_to_async(sessions.create, thread_sensitive=False)(params)
+        except stripe.StripeError as error:
+            raise PaymentError(str(error)) from error
+        return CheckoutSession(id=session.id, url=session.url)
+
+    def parse_webhook(self, payload, headers):
+        try:
+            event = self.client.construct_event(payload, headers.get('Stripe-Signature'),
+                                                settings.STRIPE_WEBHOOK_SECRET)
+        except (ValueError, stripe.SignatureVerificationError) as error:
+            raise PaymentError(str(error)) from error
+
+        if event.type not in ('checkout.session.completed', 'checkout.session.async_payment_succeeded'):
+            return None
+        session = event.data.object.to_dict()
+        order_id = (session.get('metadata') or {}).get('order_id') or session.get('client_reference_id')
+        if not order_id:
+            return None
+        return PaymentEvent(order_id=int(order_id), paid=session.get('payment_status') == 'paid')
+
+
+# Шлюз для тестов и бенчмарков: сразу ведёт на страницу успешной оплаты.
+# LOFT_FAKE_PAYMENT_DELAY имитирует задержку платёжного сервиса (в секундах).
+class FakeGateway(PaymentGateway):
+    def __init__(self, delay=None):
+        self.delay = delay if delay is not None else getattr(settings, 'LOFT_FAKE_PAYMENT_DELAY', 0)
+        self.sessions = {}
+
+    async def create_checkout_session(self, order_id, amount, success_url, cancel_url):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        session_id = f'fake_{uuid.uuid4().hex}'
+        self.sessions[session_id] = {'order_id': order_id, 'amount': amount}
+        separator = '&' if '?' in success_url else '?'
+        return CheckoutSession(id=session_id, url=f'{success_url}{separator}{urlencode({"session_id": session_id})}')
+
+    # Вебхук: JSON {"order_id": 1, "paid": true}, подпись - HMAC-SHA256 от тела с SECRET_KEY
+    @staticmethod
+    def sign(payload):
+        return hmac.new(settings.SECRET_KEY.encode(), payload, hashlib.sha256).hexdigest()
+
+    def parse_webhook(self, payload, headers):
+        if not hmac.compare_digest(self.sign(payload), headers.get('X-Fake-Signature', '')):
+            raise PaymentError('Неверная подпись')
+        try:
+            data = json.loads(payload)
+            return PaymentEvent(order_id=int(data['order_id']), paid=bool(data.get('paid', True)))
+        except (ValueError, KeyError, TypeError) as error:
+            raise PaymentError(str(error)) from error
+
+
+def get_payment_gateway():
+    return load_gateway(getattr(settings, 'LOFT_PAYMENT_GATEWAY', 'loft.payments.StripeGateway'))
+
+
+# Шлюз создаётся один раз на процесс, вместе с ним живёт пул соединений
+@lru_cache(maxsize=None)
+def load_gateway(path):
+    return import_string(path)()
@@ -0,0 +1,27 @@
+from itertools import groupby
+from django.core.cache import cache
+from .cache import get_version, versioned_key
+from .models import Region, City
+
+
+# Города всех регионов двумя запросами: {region_id: [[название, pk], ...]}, регион без городов - [].
+# Тот же словарь, что раньше собирала checkout_view (dict_city).
+# Хранится в кэше под версией 'regions', её увеличивают изменения Region и City (см. signals.py)
+def get_cities_by_region():
+    key = versioned_key('regions', 'cities')
+    cities = cache.get(key)
+    if cities is None:
+        rows = City.objects.order_by('region_id', 'pk').values_list('region_id', 'title', 'pk')
+        cities = {region_id: [] for region_id in Region.objects.values_list('pk', flat=True)}
+        cities.update((region_id, [[title, pk] for _, title, pk in group])
+                      for region_id, group in groupby(rows, key=lambda row: row[0]))
+        cache.set(key, cities, None)
+    return cities
+
+
+def get_region_cities(region_id):
+    return get_cities_by_region().get(region_id, [])
+
+
+def get_regions_version():
+    return get_version('regions')
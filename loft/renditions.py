@@ -0,0 +1,160 @@
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, UnidentifiedImageError
+from .cache import bump_version
+
+
+logger = logging.getLogger(__name__)
+
+# Значения по умолчанию, настройки LOFT_RENDITION_* читаются при каждом вызове (override_settings в тестах)
+RENDITION_WIDTHS = (160, 320, 640, 1280)
+RENDITION_FORMATS = ('webp', 'jpeg')
+RENDITION_WORKERS = 2
+RENDITION_DIR = 'renditions'
+
+executor = None
+
+
+def get_executor():
+    global executor
+    if executor is None:
+        workers = getattr(settings, 'LOFT_RENDITION_WORKERS', RENDITION_WORKERS)
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='renditions')
+    return executor
+
+
+def is_async():
+    return getattr(settings, 'LOFT_RENDITION_ASYNC', True)
+
+
+# Уменьшенные копии картинки под каждую ширину и формат.
+# Имена файлов строятся от хэша содержимого, поэтому одинаковые фото не дублируются,
+# а файлы можно отдавать с долгим кэшированием.
+# Результат: {'source': имя оригинала, 'webp': {'320': путь, ...}, 'jpeg': {...}}
+def generate_renditions(field_file):
+    with field_file.open('rb') as file:
+        content = file.read()
+    digest = hashlib.sha256(content).hexdigest()[:16]
+
+    try:
+        original = Image.open(BytesIO(content))
+        original.load()
+    except (UnidentifiedImageError, OSError):
+        # Например SVG иконки категорий - их уменьшать не нужно
+        return {'source': field_file.name}
+
+    renditions = {'source': field_file.name}
+    widths = getattr(settings, 'LOFT_RENDITION_WIDTHS', RENDITION_WIDTHS)
+    widths = [width for width in widths if width < original.width] or [original.width]
+    for fmt in getattr(settings, 'LOFT_RENDITION_FORMATS', RENDITION_FORMATS):
+        renditions[fmt] = {}
+        for width in widths:
+            name = f'{RENDITION_DIR}/{digest}-{width}.{fmt}'
+            if not default_storage.exists(name):
+                default_storage.save(name, ContentFile(resize(original, width, fmt)))
+            renditions[fmt][str(width)] = name
+    return renditions
+
+
+def resize(original, width, fmt):
+    image = original.copy()
+    height = max(1, round(original.height * width / original.width))
+    image = image.resize((width, height), Image.LANCZOS)
+    if fmt == 'jpeg' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    buffer = BytesIO()
+    image.save(buffer, format=fmt.upper(), quality=80, optimize=True)
+    return buffer.getvalue()
+
+
+# Запускаем генерацию после коммита транзакции, в пуле фоновых потоков.
+# Картинку убрали - сразу забываем её миниатюры и удаляем их файлы
+def schedule_renditions(instance):
+    field_file = getattr(instance, instance.rendition_field)
+    if not field_file:
+        if instance.renditions:
+            stale = instance.renditions
+            type(instance).objects.filter(pk=instance.pk).update(renditions={})
+            instance.renditions = {}
+            transaction.on_commit(lambda: delete_stale_renditions(stale))
+        return
+    if instance.renditions.get('source') == field_file.name:
+        return
+
+    args = (instance._meta.label, instance.pk, field_file.name)
+    if is_async():
+        transaction.on_commit(lambda: get_executor().submit(process_renditions, *args))
+    else:
+        transaction.on_commit(lambda: process_renditions(*args))
+
+
+def process_renditions(model_label, pk, source):
+    model = apps.get_model(model_label)
+    try:
+        instance = model.objects.filter(pk=pk).first()
+        field_file = getattr(instance, model.rendition_field, None) if instance else None
+        if not field_file or field_file.name != source:
+            return  # Объект удалён или фото уже заменили
+
+        stale = instance.renditions
+        renditions = generate_renditions(field_file)
+        # update() не вызывает post_save, повторной генерации не будет
+        if model.objects.filter(pk=pk, **{model.rendition_field: source}).update(renditions=renditions):
+            delete_stale_renditions(stale)
+        bump_version('catalog')
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s #%s', model_label, pk)
+    finally:
+        if is_async():
+            close_old_connections()
+
+
+def get_rendition_names(renditions):
+    return {name for fmt, variants in renditions.items() if isinstance(variants, dict) for name in variants.values()}
+
+
+# Удаление файлов прежних миниатюр. Имена файлов - хэш содержимого, одна копия может
+# принадлежать нескольким объектам с одинаковой картинкой: такие файлы оставляем
+def delete_stale_renditions(renditions):
+    models = [model for model in apps.get_app_config('loft').get_models() if hasattr(model, 'rendition_field')]
+    for name in get_rendition_names(renditions):
+        if any(model.objects.filter(renditions__icontains=name).exists() for model in models):
+            continue
+        try:
+            default_storage.delete(name)
+        except OSError:
+            logger.exception('Не удалось удалить миниатюру %s', name)
+
+
+# Миниатюры текущей картинки: сохранённые для прежнего файла не показываем
+def get_current_renditions(renditions, field_file):
+    if field_file and renditions.get('source') == field_file.name:
+        return renditions
+    return {}
+
+
+# Ближайшая по ширине миниатюра (не меньше нужной), иначе оригинал
+def get_rendition_url(renditions, width, fmt, fallback):
+    variants = renditions.get(fmt) or {}
+    widths = sorted(int(key) for key in variants)
+    if not widths:
+        return fallback
+    suitable = [key for key in widths if key >= width]
+    if not suitable:
+        return fallback  # Нужна ширина больше всех копий - отдаём оригинал
+    return default_storage.url(variants[str(suitable[0])])
+
+
+# Значение для атрибута srcset: "url 160w, url 320w, ..."
+def get_srcset(renditions, fmt):
+    variants = renditions.get(fmt) or {}
+    return ', '.join(f'{default_storage.url(name)} {width}w'
+                     for width, name in sorted(variants.items(), key=lambda item: int(item[0])))
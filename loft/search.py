@@ -0,0 +1,227 @@
+import difflib
+import re
+from functools import lru_cache
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, Q, When
+from django.utils.module_loading import import_string
+from .models import Product
+
+
+# ========================= Стемминг =========================
+# Упрощённый стеммер Портера для русского языка (snowball), чтобы "диваны",
+# "диванов" и "диван" попадали в один термин индекса.
+
+RVRE = re.compile(r'^(.*?[аеиоуыэюя])(.*)$')
+PERFECTIVE_GERUND = re.compile(r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$')
+REFLEXIVE = re.compile(r'(с[яь])$')
+ADJECTIVE = re.compile(r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$')
+PARTICIPLE = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+VERB = re.compile(r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|'
+                  r'ыть|ишь|ую|ю)|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$')
+NOUN = re.compile(r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|'
+                  r'ия|ья|я)$')
+DERIVATIONAL = re.compile(r'.*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$')
+SUPERLATIVE = re.compile(r'(ейше|ейш)$')
+WORD = re.compile(r'\w+')
+
+
+@lru_cache(maxsize=10000)
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    match = RVRE.match(word)
+    if not match:
+        return word
+
+    start, rv = match.groups()
+    temp = PERFECTIVE_GERUND.sub('', rv, 1)
+    if temp == rv:
+        rv = REFLEXIVE.sub('', rv, 1)
+        temp = ADJECTIVE.sub('', rv, 1)
+        if temp != rv:
+            rv = PARTICIPLE.sub('', temp, 1)
+        else:
+            temp = VERB.sub('', rv, 1)
+            rv = NOUN.sub('', rv, 1) if temp == rv else temp
+    else:
+        rv = temp
+
+    rv = re.sub('и$', '', rv)
+    if DERIVATIONAL.match(rv):
+        rv = re.sub('ость?$', '', rv)
+
+    temp = re.sub('ь$', '', rv)
+    if temp == rv:
+        rv = SUPERLATIVE.sub('', rv, 1)
+        rv = re.sub('нн$', 'н', rv)
+    else:
+        rv = temp
+    return start + rv
+
+
+def tokenize(text):
+    return [stem(word) for word in WORD.findall(text or '')]
+
+
+# ========================= Бэкенды поиска =========================
+
+class SearchBackend:
+    # Создание служебных таблиц (вызывается после migrate, см. signals.py)
+    def setup(self):
+        pass
+
+    def index_products(self, products):
+        raise NotImplementedError
+
+    def remove_products(self, product_ids):
+        raise NotImplementedError
+
+    def rebuild(self, batch_size=1000):
+        raise NotImplementedError
+
+    # Идентификаторы товаров по релевантности
+    def search(self, query, limit, offset=0):
+        raise NotImplementedError
+
+    def count(self, query):
+        raise NotImplementedError
+
+
+# Запасной бэкенд для баз без полнотекстового поиска
+class SimpleSearchBackend(SearchBackend):
+    def index_products(self, products):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def rebuild(self, batch_size=1000):
+        pass
+
+    def get_queryset(self, query):
+        condition = Q()
+        for word in WORD.findall(query):
+            condition &= (Q(title__icontains=word) | Q(description__icontains=word) |
+                          Q(color_name__icontains=word) | Q(model__title__icontains=word))
+        return Product.objects.filter(condition).order_by('-pk') if condition else Product.objects.none()
+
+    def search(self, query, limit, offset=0):
+        return list(self.get_queryset(query).values_list('pk', flat=True)[offset:offset + limit])
+
+    def count(self, query):
+        return self.get_queryset(query).count()
+
+
+# Инвертированный индекс SQLite FTS5: в индекс кладём основы слов (после стемминга),
+# поиск идёт по префиксам, опечатки исправляем по словарю терминов индекса.
+class SqliteSearchBackend(SearchBackend):
+    table = 'loft_product_search'
+    vocabulary = 'loft_product_search_vocab'
+    title_weight = 10.0
+    body_weight = 1.0
+
+    def setup(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} "
+                           f"USING fts5(title, body, tokenize='unicode61 remove_diacritics 0', prefix='2 3')")
+            cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.vocabulary} "
+                           f"USING fts5vocab({self.table}, 'row')")
+
+    def index_products(self, products):
+        rows = []
+        for product in products:
+            title = ' '.join(tokenize(f'{product.title} {product.model.title if product.model else ""}'))
+            body = ' '.join(tokenize(f'{product.description} {product.color_name}'))
+            rows.append((product.pk, title, body))
+        if not rows:
+            return
+
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(f'INSERT INTO {self.table} (rowid, title, body) VALUES (%s, %s, %s)', rows)
+
+    def remove_products(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+    def rebuild(self, batch_size=1000):
+        self.setup()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+        products = Product.objects.select_related('model').order_by('pk')
+        batch = []
+        for product in products.iterator(chunk_size=batch_size):
+            batch.append(product)
+            if len(batch) >= batch_size:
+                self.index_products(batch)
+                batch = []
+        self.index_products(batch)
+
+    # Запрос FTS5: каждое слово как префикс, "дива" найдёт "диван", "диваны"
+    def build_match(self, query):
+        groups = [self.correct_term(term) for term in tokenize(query)]
+        return ' AND '.join('(' + ' OR '.join(f'"{term}"*' for term in terms) + ')' for terms in groups)
+
+    # Если такого префикса нет в индексе, берём ближайшие по написанию термины
+    def correct_term(self, term):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT term FROM {self.vocabulary} WHERE term >= %s AND term < %s LIMIT 1',
+                           [term, term + '\U0010ffff'])
+            if cursor.fetchone():
+                return [term]
+
+            cursor.execute(f'SELECT term FROM {self.vocabulary} WHERE term >= %s AND term < %s',
+                           [term[0], chr(ord(term[0]) + 1)])
+            candidates = [row[0] for row in cursor.fetchall()]
+
+        return difflib.get_close_matches(term, candidates, n=3, cutoff=0.75) or [term]
+
+    def search(self, query, limit, offset=0):
+        match = self.build_match(query)
+        if not match:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s '
+                           f'ORDER BY bm25({self.table}, %s, %s) LIMIT %s OFFSET %s',
+                           [match, self.title_weight, self.body_weight, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+    def count(self, query):
+        match = self.build_match(query)
+        if not match:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {self.table} WHERE {self.table} MATCH %s', [match])
+            return cursor.fetchone()[0]
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    backend = getattr(settings, 'LOFT_SEARCH_BACKEND', None)
+    if backend is None:
+        backend = 'loft.search.SqliteSearchBackend' if connection.vendor == 'sqlite' \
+            else 'loft.search.SimpleSearchBackend'
+    return import_string(backend)()
+
+
+# Результаты поиска для Paginator: считаются и достаются из индекса по страницам
+class SearchResults:
+    def __init__(self, query, backend=None):
+        self.query = query
+        self.backend = backend or get_search_backend()
+
+    def count(self):
+        return self.backend.count(self.query)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+
+        start = item.start or 0
+        ids = self.backend.search(self.query, limit=item.stop - start, offset=start)
+        order = Case(*[When(pk=pk, then=position) for position, pk in enumerate(ids)])
+        return list(Product.objects.filter(pk__in=ids).with_images().order_by(order)) if ids else []
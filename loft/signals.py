@@ -0,0 +1,120 @@
+from django.db.models.signals import post_init, post_save, pre_delete, post_delete, post_migrate
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from .cache import bump_version
+from .models import Category, ImageProduct, Product, ProductModel, Order, OrderProduct, Region, City
+from .renditions import delete_stale_renditions, schedule_renditions
+from .search import get_search_backend
+from .jobs import enqueue_index_products
+
+
+# Пересчитываем суммы заказа при любом изменении его товаров
+@receiver([post_save, post_delete], sender=OrderProduct)
+def update_order_totals(sender, instance, **kwargs):
+    if instance.order_id:
+        Order.objects.filter(pk=instance.order_id).update_totals()
+
+
+PRICE_FIELDS = ('price', 'discount')
+
+
+# Цена и скидка товара на момент загрузки. Отложенные поля (only/defer) не читаем - это лишний запрос,
+# для них сравнение ниже считает цену изменившейся
+@receiver(post_init, sender=Product)
+def remember_prices(sender, instance, **kwargs):
+    instance._saved_prices = get_prices(instance)
+
+
+def get_prices(product):
+    return tuple(product.__dict__.get(name) for name in PRICE_FIELDS)
+
+
+# Цена или скидка товара изменились - пересчитываем неоплаченные корзины с этим товаром.
+# Сохранение остатков, названия и т.п. корзины не трогает
+@receiver(post_save, sender=Product)
+def update_cart_totals(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not set(PRICE_FIELDS) & set(update_fields):
+        return
+    prices = get_prices(instance)
+    changed = prices != instance._saved_prices
+    instance._saved_prices = prices
+    if changed and not created:
+        Order.objects.filter(payment=False, awaiting_payment=False, orderproduct__product=instance).update_totals()
+
+
+# Удаление товара обнуляет OrderProduct.product массовым UPDATE (SET_NULL) без сигналов,
+# поэтому заказы с этим товаром запоминаем до удаления и пересчитываем после
+@receiver(pre_delete, sender=Product)
+def remember_product_orders(sender, instance, **kwargs):
+    instance._order_ids = list(Order.objects.filter(payment=False, orderproduct__product=instance)
+                               .values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Product)
+def update_deleted_product_orders(sender, instance, **kwargs):
+    order_ids = getattr(instance, '_order_ids', None)
+    if order_ids:
+        Order.objects.filter(pk__in=order_ids).update_totals()
+
+
+# Любое изменение категорий сбрасывает закэшированное дерево категорий
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_tree(sender, **kwargs):
+    bump_version('category_tree')
+
+
+# Справочник городов для оформления заказа (regions.py, region_cities_view)
+@receiver([post_save, post_delete], sender=Region)
+@receiver([post_save, post_delete], sender=City)
+def invalidate_regions(sender, **kwargs):
+    bump_version('regions')
+
+
+# Изменения каталога сбрасывают закэшированные страницы (CatalogCacheMixin)
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=ImageProduct)
+@receiver([post_save, post_delete], sender=ProductModel)
+def invalidate_catalog_pages(sender, **kwargs):
+    bump_version('catalog')
+
+
+# Смена фото меняет карточку товара - обновляем updated_at, от него зависит ключ кэша карточки
+@receiver([post_save, post_delete], sender=ImageProduct)
+def touch_product(sender, instance, **kwargs):
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+
+# После загрузки фото товара или иконки категории готовим уменьшенные копии в фоне
+@receiver(post_save, sender=ImageProduct)
+@receiver(post_save, sender=Category)
+def create_renditions(sender, instance, **kwargs):
+    schedule_renditions(instance)
+
+
+@receiver(post_delete, sender=ImageProduct)
+@receiver(post_delete, sender=Category)
+def delete_renditions(sender, instance, **kwargs):
+    if instance.renditions:
+        transaction.on_commit(lambda: delete_stale_renditions(instance.renditions))
+
+
+# Поисковый индекс обновляется задачей очереди (jobs.py, run_workers), а не в запросе.
+# Задача ставится в той же транзакции, что и изменение товара
+@receiver([post_save, post_delete], sender=Product)
+def index_product(sender, instance, **kwargs):
+    enqueue_index_products([instance.pk])
+
+
+@receiver(post_save, sender=ProductModel)
+def index_model_products(sender, instance, created, **kwargs):
+    if not created:
+        enqueue_index_products(instance.product_set.values_list('pk', flat=True))
+
+
+# Таблицы поискового индекса создаём после migrate
+@receiver(post_migrate)
+def setup_search_backend(sender, **kwargs):
+    if sender.label == 'loft':
+        get_search_backend().setup()
@@ -0,0 +1,228 @@
+import gzip
+import logging
+import mimetypes
+import re
+from pathlib import Path
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+COMPRESS_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.xml', '.map', '.ttf', '.otf', '.eot', '.ico')
+COMPRESS_MIN_SIZE = 256
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^/]+$')  # style.1a2b3c4d5e6f.css
+STATIC_MAX_AGE = 60 * 60 * 24 * 365
+
+
+# ========================= Минификация =========================
+# Консервативная: удаляются комментарии и лишние пробелы, строки в кавычках не трогаются.
+
+CSS_TOKENS = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|(/\*.*?\*/)|(\s+)|([^"'/\s]+|/)''', re.S)
+CSS_PUNCTUATION = '{};,>'
+
+
+def minify_css(text):
+    parts = []
+    for string, comment, space, other in CSS_TOKENS.findall(text):
+        if comment:
+            if comment.startswith('/*!'):
+                parts.append(comment)  # /*! ... */ - лицензии оставляем
+        elif space:
+            if parts and not parts[-1].endswith(tuple(CSS_PUNCTUATION)):
+                parts.append(' ')
+        elif other and other[0] in CSS_PUNCTUATION and parts and parts[-1] == ' ':
+            parts[-1] = other
+        else:
+            parts.append(string or other)
+    return ''.join(parts).replace(';}', '}').strip()
+
+
+# Переводы строк сохраняем, чтобы не сломать автоматическую расстановку точек с запятой.
+# Регулярные выражения с кавычками внутри (/"/) не поддерживаются, в скриптах магазина их нет.
+def minify_js(text):
+    result = []
+    i, length = 0, len(text)
+    while i < length:
+        char = text[i]
+        if char in '\'"`':
+            end = i + 1
+            while end < length and text[end] != char:
+                end += 2 if text[end] == '\\' else 1
+            result.append(text[i:end + 1])
+            i = end + 1
+        elif text.startswith('//', i):
+            i = text.find('\n', i)
+            i = length if i == -1 else i
+        elif text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = length if end == -1 else end + 2
+            result.append(' ')
+        elif char == '\\':
+            result.append(text[i:i + 2])
+            i += 2
+        elif char.isspace():
+            end = i
+            while end < length and text[end].isspace():
+                end += 1
+            result.append('\n' if '\n' in text[i:end] else ' ')
+            i = end
+        else:
+            result.append(char)
+            i += 1
+
+    lines = (line.strip() for line in ''.join(result).split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+MINIFIERS = {
+    '.css': minify_css,
+    '.js': minify_js,
+}
+
+
+# ========================= Хранилище для collectstatic =========================
+
+# collectstatic: минификация CSS/JS, имена с хэшем содержимого (style.1a2b3c4d5e6f.css, манифест
+# staticfiles.json) и рядом сжатые копии .gz и .br (brotli - если установлен пакет brotli)
+class LoftStaticFilesStorage(ManifestStaticFilesStorage):
+    # Минифицируем только свои файлы: статика админки и пакетов уже сжата их авторами
+    minify_prefixes = ('loft/',)
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            return
+
+        # Минифицируем собранные копии до хэширования. HashedFilesMixin читает файлы из исходного
+        # хранилища (paths), поэтому для минифицированных подставляем копию из STATIC_ROOT -
+        # и хэш, и файл с хэшем в имени получаются из минифицированного содержимого
+        paths = dict(paths)
+        for name, (storage, path) in list(paths.items()):
+            minify = MINIFIERS.get(Path(name).suffix)
+            if not minify or not name.startswith(self.minify_prefixes) or '.min.' in name:
+                continue
+            with storage.open(path) as file:
+                source = file.read().decode('utf-8')
+            if self.exists(name):
+                self.delete(name)
+            self._save(name, ContentFile(minify(source).encode('utf-8')))
+            paths[name] = (self, name)
+
+        processed = []
+        for name, hashed_name, result in super().post_process(paths, dry_run, **options):
+            if hashed_name and not isinstance(result, Exception):
+                processed.append(hashed_name)
+            yield name, hashed_name, result
+
+        for name in processed:
+            yield from self.compress(name)
+
+    def compress(self, name):
+        if not name.endswith(COMPRESS_EXTENSIONS):
+            return
+        with self.open(name) as file:
+            content = file.read()
+        if len(content) < COMPRESS_MIN_SIZE:
+            return
+
+        variants = [('.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(content, quality=11)))
+        for extension, compressed in variants:
+            if len(compressed) < len(content) * 0.95:  # Сжатие почти ничего не даёт - файл не нужен
+                compressed_name = name + extension
+                if self.exists(compressed_name):
+                    self.delete(compressed_name)
+                self._save(compressed_name, ContentFile(compressed))
+                yield name, compressed_name, True
+
+    # Ссылки CSS на отсутствующие файлы (например, шрифты, не добавленные в репозиторий)
+    # оставляем как есть, а не прерываем collectstatic. Пишем в DEBUG: таких ссылок десятки
+    def hashed_name(self, name, content=None, filename=None):
+        try:
+            return super().hashed_name(name, content, filename)
+        except ValueError:
+            if content is not None:
+                raise
+            logger.debug('Статический файл %s не найден, ссылка оставлена без хэша', name)
+            return name
+
+
+# ========================= Раздача =========================
+
+# Раздача собранной статики из STATIC_ROOT, когда перед приложением нет nginx.
+# Файлы с хэшем в имени кэшируются браузером на год (immutable), сжатая копия .br/.gz
+# выбирается по Accept-Encoding. Включается настройкой LOFT_SERVE_STATIC.
+class StaticFilesMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'LOFT_SERVE_STATIC', False) or not settings.STATIC_ROOT:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefix = '/' + settings.STATIC_URL.lstrip('/')
+        self.root = str(settings.STATIC_ROOT)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.serve(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        response = await sync_to_async(self.serve)(request) if request.path.startswith(self.prefix) else None
+        return response or await self.get_response(request)
+
+    # None - файла нет, запрос обработают остальные middleware и urls
+    def serve(self, request):
+        if request.method not in ('GET', 'HEAD') or not request.path.startswith(self.prefix):
+            return None
+        name = request.path[len(self.prefix):]
+        try:
+            path = Path(safe_join(self.root, name))
+        except SuspiciousFileOperation:
+            return None
+        if not name or not path.is_file():
+            return None
+
+        content_type, _ = mimetypes.guess_type(name)
+        encoding, served_path = self.negotiate(request, path)
+        stat = served_path.stat()
+        if not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(served_path.open('rb'), content_type=content_type or 'application/octet-stream')
+            response['Last-Modified'] = http_date(stat.st_mtime)
+            if encoding:
+                response['Content-Encoding'] = encoding
+
+        response['Vary'] = 'Accept-Encoding'
+        if HASHED_NAME.search(name):
+            response['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}, immutable'
+        else:
+            response['Cache-Control'] = 'public, max-age=60'
+        return response
+
+    @staticmethod
+    def negotiate(request, path):
+        accepted = {value.split(';')[0].strip() for value in request.headers.get('Accept-Encoding', '').split(',')}
+        for encoding, extension in (('br', '.br'), ('gzip', '.gz')):
+            compressed = path.with_name(path.name + extension)
+            if encoding in accepted and compressed.is_file():
+                return encoding, compressed
+        return None, path
@@ -1,12 +1,13 @@
 from django import template
-from loft.models import Category, Product
+from loft.models import Product
+from loft.catalog import get_category_tree
 
 register = template.Library()
 
 
 @register.simple_tag()
-def get_categories():  # Функция для получения Категорий у которых нет родителей
-    return Category.objects.filter(parent=None)
+def get_categories():  # Функция для получения Категорий у которых нет родителей (из кэша, с подкатегориями в children)
+    return get_category_tree()
 
 
 @register.simple_tag()
@@ -20,6 +21,29 @@ def get_colors_product(model, category):
     products = Product.objects.filter(model=model, category=category)
     return products
 
+# Функция для получения цветов товара из заранее собранных вариантов страницы (без запроса)
+@register.simple_tag()
+def get_variants(variants, product):
+    return variants.get((product.model_id, product.category_id), [])
+
+# Фильтры для адаптивных картинок: <img src="{{ image|rendition:320 }}" srcset="{{ image|srcset }}">
+@register.filter()
+def srcset(image, fmt='webp'):
+    return image.get_srcset(fmt) if image else ''
+
+
+@register.filter()
+def rendition(image, width):
+    return image.get_rendition_url(int(width)) if image else ''
+
+# Ключ кэша карточки товара, меняется вместе с updated_at товара:
+# {% cache 3600 product_card product|card_cache_key %} ... {% endcache %}
+# Сердечко избранного должно быть вне кэшируемого блока
+@register.filter()
+def card_cache_key(product):
+    updated_at = product.updated_at.timestamp() if product.updated_at else ''
+    return f'{product.pk}:{updated_at}'
+
 # Функция для сбора запроса фильрации
 @register.simple_tag(takes_context=True)
 def query_params(context, **kwargs):
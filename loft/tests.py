@@ -1,3 +1,1029 @@
-from django.test import TestCase
+import base64
+import gzip
+import json
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from pathlib import Path
+from PIL import Image
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from django.contrib.auth.models import AnonymousUser, User
+from django.http import HttpResponse, QueryDict
+from django.template.response import SimpleTemplateResponse
+from django.middleware.csrf import get_token
+from django.views import View
+from .models import (Category, Product, ImageProduct, Customer, Order, OrderProduct, Region, City,
+                     ShippingAddress, Job, FavoriteProduct, ProductRecommendation, ProductModel)
+from .management.commands.build_recommendations import Command as BuildRecommendations
+from .cache import CatalogCacheMixin
+from .instrumentation import RequestStats
+from .catalog import get_bought_together, get_category_tree
+from .favorites import get_favorite_ids, toggle_favorite
+from .facets import get_category_facets
+from .filters import ProductFilter
+from .feeds import export_rows, import_products, read_rows
+from .inventory import commit_stock, find_shortages
+from .jobs import enqueue, job_handler, purge_done_jobs, run_pending_jobs
+from .regions import get_cities_by_region
+from .pagination import InvalidCursor, KeysetPaginator
+from .search import get_search_backend, stem, tokenize
+from .payments import FakeGateway, PaymentError
+from .staticfiles import minify_css
+from .utils import get_user_order, load_cart
+from .views import FavoriteListView, save_shipping_address
+
 
 # Create your tests here.
+
+class LoadCartTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.category = Category.objects.create(title='Диваны', slug='divany')
+        self.order = Order.objects.create(customer=Customer.objects.create(user=self.user))
+
+    def add_line(self, number, quantity=1, discount=None):
+        product = Product.objects.create(title=f'Товар {number}', description='-', price=1000, discount=discount,
+                                         color_name='Белый', width='1', depth='1', height='1',
+                                         category=self.category, slug=f'product-{number}')
+        ImageProduct.objects.create(product=product, image=f'images/product-{number}.jpg')
+        return OrderProduct.objects.create(order=self.order, product=product, quantity=quantity)
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        self.add_line(1)
+        with self.assertNumQueries(4):
+            load_cart(self.user)
+
+        for number in range(2, 10):
+            self.add_line(number)
+        with self.assertNumQueries(4):
+            cart = load_cart(self.user)
+
+        self.assertEqual(len(cart.lines), 9)
+        self.assertTrue(all(line.image_url.endswith('.jpg') for line in cart.lines))
+
+    def test_totals_and_discount(self):
+        self.add_line(1, quantity=2)
+        self.add_line(2, quantity=1, discount=10)
+
+        cart = load_cart(self.user)
+
+        self.assertEqual(cart.order, self.order)
+        self.assertEqual(cart.total_quantity, 3)
+        self.assertEqual(cart.total_price, 2900)
+        self.assertEqual(sum(line.total_price for line in cart.lines), cart.total_price)
+
+
+class OrderTotalsTestCase(TestCase):
+    def setUp(self):
+        category = Category.objects.create(title='Диваны', slug='divany')
+        self.sofa, self.table = [
+            Product.objects.create(title=title, description='-', price=price, discount=discount, color_name='Белый',
+                                   width='1', depth='1', height='1', category=category, slug=slug)
+            for title, price, discount, slug in [('Диван', 1000, 10, 'divan'), ('Стол', 500, None, 'stol')]
+        ]
+        self.order = Order.objects.create(customer=Customer.objects.create(user=User.objects.create(username='u')))
+
+    def assertTotals(self, total_price, total_quantity):
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.total_price, self.order.total_quantity), (total_price, total_quantity))
+
+    def count_order_updates(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        return sum(query['sql'].startswith('UPDATE "loft_order"') for query in queries)
+
+    def test_line_add_update_delete(self):
+        line = OrderProduct.objects.create(order=self.order, product=self.sofa, quantity=2)
+        self.assertTotals(1800, 2)
+        OrderProduct.objects.create(order=self.order, product=self.table, quantity=1)
+        self.assertTotals(2300, 3)
+
+        line.quantity = 1
+        line.save()
+        self.assertTotals(1400, 2)
+
+        line.delete()
+        self.assertTotals(500, 1)
+
+    def test_only_price_changes_recalculate_carts(self):
+        OrderProduct.objects.create(order=self.order, product=self.sofa, quantity=2)
+        sofa = Product.objects.get(pk=self.sofa.pk)
+
+        sofa.title = 'Диван угловой'
+        self.assertEqual(self.count_order_updates(sofa.save), 0)
+        sofa.price = 2000
+        self.assertEqual(self.count_order_updates(lambda: sofa.save(update_fields=['title'])), 0)
+        self.assertEqual(self.count_order_updates(sofa.save), 1)
+        self.assertTotals(3600, 2)
+
+        sofa.discount = None
+        sofa.save(update_fields=['discount'])
+        self.assertTotals(4000, 2)
+
+        Product.objects.only('pk', 'quantity').get(pk=self.sofa.pk).save()  # Остатки - без пересчёта
+        self.assertTotals(4000, 2)
+
+    def test_deleted_product_is_removed_from_totals(self):
+        awaiting = Order.objects.create(customer=self.order.customer, awaiting_payment=True,
+                                       payment_started_at=timezone.now())
+        for order in (self.order, awaiting):
+            OrderProduct.objects.create(order=order, product=self.sofa, quantity=2)
+            OrderProduct.objects.create(order=order, product=self.table, quantity=1)
+
+        self.table.delete()
+
+        self.assertTotals(1800, 2)
+        cart = load_cart(self.order.customer.user)
+        self.assertEqual((cart.total_price, cart.total_quantity), (1800, 2))
+        awaiting.refresh_from_db()
+        self.assertEqual((awaiting.total_price, awaiting.total_quantity), (1800, 2))
+
+        Order.objects.update_totals()
+        self.assertTotals(1800, 2)
+
+    def test_rebuild_order_totals(self):
+        OrderProduct.objects.create(order=self.order, product=self.sofa, quantity=2)
+        paid = Order.objects.create(customer=self.order.customer, payment=True)
+        OrderProduct.objects.create(order=paid, product=self.table, quantity=1)
+        Order.objects.update(total_price=0, total_quantity=0)
+
+        call_command('rebuild_order_totals', '--unpaid', stdout=StringIO())
+        self.assertTotals(1800, 2)
+        self.assertEqual(Order.objects.get(pk=paid.pk).total_quantity, 0)
+
+        call_command('rebuild_order_totals', stdout=StringIO())
+        self.assertEqual(Order.objects.get(pk=paid.pk).total_price, 500)
+
+class ImportProductsTestCase(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(title='Диваны', slug='divany')
+        self.product = Product.objects.create(title='Диван', description='-', price=1000, color_name='Белый',
+                                              width='1', depth='1', height='1', category=self.category,
+                                              slug='divan')
+        self.order = Order.objects.create(customer=Customer.objects.create(user=User.objects.create(username='u')))
+        OrderProduct.objects.create(order=self.order, product=self.product, quantity=2)
+
+    def test_upsert_by_slug(self):
+        rows = [
+            (2, {'slug': 'divan', 'price': '1500'}),
+            (3, {'slug': 'stol', 'title': 'Стол', 'description': '-', 'price': '500', 'color_name': 'Белый',
+                 'width': '1', 'depth': '1', 'height': '1', 'category': 'divany', 'model': 'Лофт'}),
+            (4, {'slug': 'stul', 'title': 'Стул', 'price': '100', 'category': 'net-takoy'}),
+        ]
+
+        result = import_products(rows, batch_size=2)
+
+        self.assertEqual((result.created, result.updated), (1, 1))
+        self.assertEqual([line_num for line_num, _ in result.errors], [4])
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.price, self.product.title), (1500, 'Диван'))
+        self.assertEqual(Product.objects.get(slug='stol').model.title, 'Лофт')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_price, 3000)
+
+    def test_export_rows_round_trip(self):
+        rows = list(export_rows())
+        self.assertEqual(rows[0]['category'], 'divany')
+
+        result = import_products(enumerate(rows, start=1))
+        self.assertEqual((result.created, result.updated, result.errors), (0, 1, []))
+
+    def test_invalid_rows_do_not_abort_batch(self):
+        lines = [
+            '{"slug": "divan", "price": "1200"}',
+            '{"slug": "stol", "title": "Стол", "category": "divany"}',  # Новый товар без цены
+            '{"slug": "stul", "price": ',
+            '["stul"]',
+            '{"slug": "shkaf", "title": "Шкаф", "price": "700", "category": "divany"}',
+        ]
+
+        result = import_products(read_rows(lines, 'jsonl'))
+
+        self.assertEqual((result.created, result.updated), (1, 1))
+        errors = dict(result.errors)
+        self.assertEqual(sorted(errors), [2, 3, 4])
+        self.assertIn('price', errors[2])
+        self.assertTrue(Product.objects.filter(slug='shkaf').exists())
+
+
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        category = Category.objects.create(title='Диваны', slug='divany')
+        Product.objects.bulk_create([
+            Product(title=f'Диван {i}', description='-', price=1000, discount=10, color_name='Белый',
+                    width='1', depth='1', height='1', category=category, slug=f'divan-{i}')
+            for i in range(7)
+        ])
+        # Половина товаров добавлена в одну и ту же секунду - порядок внутри решает pk
+        tie = timezone.now()
+        Product.objects.filter(pk__in=Product.objects.order_by('pk').values('pk')[:4]).update(created_at=tie)
+        self.paginator = KeysetPaginator(Product.objects.all(), 3)
+        self.expected = list(Product.objects.order_by('-created_at', '-pk'))
+
+    def test_pages_follow_each_other_without_gaps(self):
+        pages = [self.paginator.page()]
+        while pages[-1].has_next():
+            pages.append(self.paginator.page(pages[-1].next_cursor))
+
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual([product for page in pages for product in page], self.expected)
+        self.assertFalse(pages[0].has_previous())
+
+        previous = self.paginator.page(pages[-1].previous_cursor)
+        self.assertEqual(list(previous), list(pages[1]))
+
+    def test_tampered_cursor_is_404(self):
+        cursor = self.paginator.page().next_cursor
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))['v']
+
+        def encode(data):
+            return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+        for tampered in ('мусор', cursor[:-4], encode({'d': 'next', 'v': [None, values[1]]}),
+                         encode({'d': 'next', 'v': ['вчера', values[1]]}), encode({'d': 'next', 'v': values[:1]}),
+                         encode({'d': 'up', 'v': values}), encode([1, 2]), encode({'d': 'next', 'v': 'ab'})):
+            with self.subTest(cursor=tampered):
+                with self.assertRaises(InvalidCursor):
+                    self.paginator.page(tampered)
+                self.assertEqual(self.client.get(reverse('sales'), {'cursor': tampered}).status_code, 404)
+
+class SearchTestCase(TestCase):
+    def setUp(self):
+        category = Category.objects.create(title='Мебель', slug='mebel')
+        self.create = lambda title, description, slug: Product.objects.create(
+            title=title, description=description, price=1000, color_name='Белый', width='1', depth='1',
+            height='1', category=category, slug=slug)
+
+    def test_stemming_joins_word_forms(self):
+        self.assertEqual({stem('кресло'), stem('кресла'), stem('креслами'), stem('Креслу')}, {stem('кресло')})
+        self.assertEqual(tokenize('Кожаные кресла, зелёные'), tokenize('кожаное кресло зеленое'))
+
+    def test_index_is_updated_by_job_and_title_ranks_first(self):
+        in_description = self.create('Стол обеденный', 'Подходит к дивану и креслам', 'stol')
+        in_title = self.create('Диван угловой', 'Мягкий', 'divan')
+        backend = get_search_backend()
+        self.assertEqual(backend.search('диваны', limit=10), [])
+
+        run_pending_jobs()
+
+        self.assertEqual(backend.search('диваны', limit=10), [in_title.pk, in_description.pk])
+        self.assertEqual(backend.search('дивна', limit=10)[0], in_title.pk)  # Опечатка
+
+        in_title.delete()
+        run_pending_jobs()
+        self.assertEqual(backend.search('диван', limit=10), [in_description.pk])
+
+    @override_settings(STORAGES={**settings.STORAGES, 'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}})
+    def test_search_page(self):
+        self.create('Диван угловой', 'Мягкий', 'divan')
+        run_pending_jobs()
+
+        response = self.client.get(reverse('search'), {'q': 'диваны'})
+
+        self.assertContains(response, 'Диван угловой')
+        self.assertEqual(response.context['paginator'].count, 1)
+
+class CatalogCacheTestCase(TestCase):
+    class PageView(CatalogCacheMixin, View):
+        calls = 0
+
+        def get(self, request, *args, **kwargs):
+            type(self).calls += 1
+            response = HttpResponse(f'page {type(self).calls}')
+            if request.GET.get('token'):
+                get_token(request)
+            if request.GET.get('cookie'):
+                response.set_cookie('seen', '1')
+            return response
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.PageView.calls = 0
+
+    class SlowTemplate:
+        def render(self, context=None, request=None):
+            time.sleep(0.005)
+            return 'page'
+
+    class TemplatePageView(CatalogCacheMixin, View):
+        def get(self, request, *args, **kwargs):
+            return SimpleTemplateResponse(CatalogCacheTestCase.SlowTemplate())
+
+    def get(self, path, user=None, view=None, stats=None):
+        request = self.factory.get(path)
+        request.user = user or AnonymousUser()
+        request.resolver_match = resolve(path.split('?')[0])
+        if stats is not None:
+            request.instrumentation = stats
+        return (view or self.PageView).as_view()(request)
+
+    def test_anonymous_hit_and_authenticated_bypass(self):
+        self.assertEqual(self.get('/sales/').content, self.get('/sales/').content)
+        self.assertEqual(self.PageView.calls, 1)
+
+        self.get('/sales/', user=User.objects.create(username='buyer'))
+        self.assertEqual(self.PageView.calls, 2)
+
+    def test_pages_with_cookies_or_csrf_are_not_cached(self):
+        for path in ('/sales/?cookie=1', '/sales/?token=1'):
+            self.get(path)
+            self.get(path)
+        self.assertEqual(self.PageView.calls, 4)
+
+    def test_render_time_is_recorded_for_cached_pages(self):
+        miss, hit = RequestStats(), RequestStats()
+        self.get('/sales/', view=self.TemplatePageView, stats=miss)
+        response = self.get('/sales/', view=self.TemplatePageView, stats=hit)
+
+        self.assertEqual(response.content, b'page')
+        self.assertGreaterEqual(miss.template_time, 0.005)
+        self.assertEqual(hit.template_time, 0)  # Из кэша - без рендера
+
+    def test_each_filter_and_empty_cursor_get_own_key(self):
+        for path in ('/sales/', '/sales/?cursor=', '/sales/?from=100', '/sales/?from=100&till=200',
+                     '/sales/?till=200&from=100', '/sales/?utm_source=mail'):
+            self.get(path)
+        self.assertEqual(self.PageView.calls, 4)
+
+    def test_product_save_invalidates_pages(self):
+        self.get('/sales/')
+        category = Category.objects.create(title='Диваны', slug='divany')
+        product = Product.objects.create(title='Диван', description='-', price=1000, color_name='Белый',
+                                         width='1', depth='1', height='1', category=category, slug='divan')
+        self.get('/sales/')
+        product.price = 900
+        product.save()
+        self.get('/sales/')
+        self.assertEqual(self.PageView.calls, 3)
+
+    def test_timeout_setting_is_read_per_request(self):
+        with self.settings(LOFT_PAGE_CACHE_TIMEOUT=0):  # 0 - не кэшировать
+            self.get('/sales/')
+            self.get('/sales/')
+        self.assertEqual(self.PageView.calls, 2)
+
+
+class CategoryFilterTestCase(TestCase):
+    def setUp(self):
+        self.furniture = Category.objects.create(title='Мебель', slug='mebel')
+        self.sofas = Category.objects.create(title='Диваны', slug='divany', parent=self.furniture)
+        self.tables = Category.objects.create(title='Столы', slug='stoly', parent=self.furniture)
+        lamps = Category.objects.create(title='Лампы', slug='lampy',
+                                        parent=Category.objects.create(title='Свет', slug='svet'))
+        self.oslo = ProductModel.objects.create(title='Осло')
+
+        self.add_product('cheap', 999.5, self.sofas, 'Белый', model=self.oslo)
+        self.add_product('exact', 1000, self.sofas, 'Серый', model=self.oslo)
+        self.add_product('fraction', 1000.9, self.tables, 'Белый')
+        self.add_product('above', 1001, self.tables, 'Белый')
+        self.add_product('lamp', 1000, lamps, 'Белый', model=self.oslo)  # Другая категория
+
+    def add_product(self, slug, price, category, color_name, model=None):
+        product = Product.objects.create(title=slug, description='-', price=price, color_name=color_name,
+                                         width='1', depth='1', height='1', category=category, slug=slug,
+                                         model=model)
+        ImageProduct.objects.create(product=product, image=f'images/{slug}.jpg')
+
+    def filter(self, query):
+        return {product.slug for product in ProductFilter(self.furniture, QueryDict(query)).get_queryset()}
+
+    def test_price_range(self):
+        # till сохраняет прежнее правило int(price) <= till
+        self.assertEqual(self.filter('till=1000'), {'cheap', 'exact', 'fraction'})
+        self.assertEqual(self.filter('from=1000'), {'exact', 'fraction', 'above'})
+        self.assertEqual(self.filter('from=1000&till=1000'), {'exact', 'fraction'})
+        self.assertEqual(self.filter('till=999'), {'cheap'})
+
+    def test_invalid_prices_are_ignored(self):
+        everything = {'cheap', 'exact', 'fraction', 'above'}
+        for query in ('from=abc', 'till=', 'from=1.5&till=x', 'till=%20'):
+            with self.subTest(query=query):
+                self.assertEqual(self.filter(query), everything)
+        self.assertEqual(self.filter('from=abc&till=1000'), {'cheap', 'exact', 'fraction'})
+
+    def test_other_filters(self):
+        self.assertEqual(self.filter('sub=Столы'), {'fraction', 'above'})
+        self.assertEqual(self.filter('color_name=Белый&till=1000'), {'cheap', 'fraction'})
+        self.assertEqual(self.filter('model=Осло'), {'cheap', 'exact'})
+
+    def test_filtered_page_is_single_limit_query(self):
+        queryset = ProductFilter(self.furniture, QueryDict('color_name=Белый&from=1000&sub=Столы')).get_queryset()
+        with CaptureQueriesContext(connection) as queries:
+            page = list(queryset[:2])
+            for product in page:
+                list(product.images.all())
+
+        self.assertEqual([product.slug for product in page], ['above', 'fraction'])
+        self.assertEqual(len(queries), 2)  # Страница товаров + картинки одним prefetch
+        products_sql, images_sql = (query['sql'] for query in queries)
+        self.assertIn('LIMIT 2', products_sql)
+        self.assertIn('"loft_product"', products_sql)
+        self.assertIn('"loft_imageproduct"', images_sql)
+
+    def test_facets_are_limited_to_category(self):
+        ProductModel.objects.create(title='Пустая')
+        Category.objects.create(title='Кресла', slug='kresla', parent=self.furniture)
+        with self.assertNumQueries(3):
+            facets = get_category_facets(self.furniture)
+
+        self.assertEqual(facets['colors'], [{'color_name': 'Белый', 'count': 3}, {'color_name': 'Серый', 'count': 1}])
+        # Лампа той же модели из другой категории в счётчик не попадает
+        self.assertEqual([(model.title, model.products_count) for model in facets['models']], [('Осло', 2)])
+        self.assertEqual([(sub.title, sub.products_count) for sub in facets['subcategories']],
+                         [('Диваны', 2), ('Столы', 2), ('Кресла', 0)])
+
+
+class CategoryTreeTestCase(TestCase):
+    def test_nodes_are_compatible_with_category_templates(self):
+        parent = Category.objects.create(title='Мебель', slug='mebel')
+        Category.objects.create(title='Диваны', slug='divany', parent=parent)
+
+        node, = get_category_tree()
+        self.assertEqual([child.title for child in node.subcategories.all()], ['Диваны'])
+        self.assertEqual(node.subcategories.count(), 1)
+
+        Category.objects.create(title='Столы', slug='stoly', parent=parent)
+        node, = get_category_tree()
+        self.assertEqual(len(node.subcategories.all()), 2)
+
+class CartApiTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.client.force_login(self.user)
+        category = Category.objects.create(title='Диваны', slug='divany')
+        Product.objects.create(title='Диван', description='-', price=1000, discount=10, quantity=2,
+                               color_name='Белый', width='1', depth='1', height='1', category=category, slug='divan')
+
+    def post(self, action, key='', **data):
+        response = self.client.post(reverse('cart_api'), {'product': 'divan', 'action': action, **data},
+                                    headers={'Idempotency-Key': key})
+        return response.json()
+
+    def test_quantity_is_limited_by_stock(self):
+        for _ in range(3):
+            data = self.post('add')
+        self.assertEqual(data['quantity'], 2)
+        self.assertEqual(data['order_total_price'], 1800)
+
+        self.assertEqual(self.post('delete')['quantity'], 1)
+        self.assertEqual(self.post('set', quantity=0)['order_total_quantity'], 0)
+        self.assertFalse(OrderProduct.objects.exists())
+
+    def test_quantity_is_parsed_as_integer(self):
+        cases = [('abc', 400), ('1.5', 400), ('', 400), ('-1', 400), ('²', 400), (' 2', 200), ('1', 200)]
+        for quantity, status in cases:
+            with self.subTest(quantity=quantity):
+                response = self.client.post(reverse('cart_api'), {'product': 'divan', 'action': 'set',
+                                                                  'quantity': quantity})
+                self.assertEqual(response.status_code, status)
+        self.assertEqual(OrderProduct.objects.get().quantity, 1)
+
+    def test_same_idempotency_key_applies_once(self):
+        first = self.post('add', key='click-1')
+        second = self.post('add', key='click-1')
+
+        self.assertEqual(first, second)
+        self.assertEqual(OrderProduct.objects.get().quantity, 1)
+
+
+class FavoritesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.category = Category.objects.create(title='Диваны', slug='divany')
+        self.sofa = self.add_product(1)
+
+    def add_product(self, number):
+        product = Product.objects.create(title=f'Товар {number}', description='-', price=1000,
+                                         color_name='Белый', width='1', depth='1', height='1',
+                                         category=self.category, slug=f'product-{number}')
+        ImageProduct.objects.create(product=product, image=f'images/product-{number}.jpg')
+        return product
+
+    def test_toggle_adds_then_removes(self):
+        self.assertTrue(toggle_favorite(self.user, self.sofa.pk))
+        self.assertEqual(FavoriteProduct.objects.get().product, self.sofa)
+
+        self.assertFalse(toggle_favorite(self.user, self.sofa.pk))
+        self.assertFalse(FavoriteProduct.objects.exists())
+
+    def test_duplicate_insert_keeps_one_row(self):
+        toggle_favorite(self.user, self.sofa.pk)
+
+        # Параллельный запрос: DELETE ничего не нашёл, а строка уже вставлена
+        with mock.patch('django.db.models.query.QuerySet.delete', return_value=(0, {})):
+            self.assertFalse(toggle_favorite(self.user, self.sofa.pk))
+        self.assertEqual(FavoriteProduct.objects.filter(user=self.user, product=self.sofa).count(), 1)
+
+    def test_cache_is_invalidated_by_toggle(self):
+        self.assertEqual(get_favorite_ids(self.user), frozenset())
+        with self.assertNumQueries(0):
+            get_favorite_ids(self.user)
+
+        toggle_favorite(self.user, self.sofa.pk)
+        self.assertEqual(get_favorite_ids(self.user), {self.sofa.pk})
+
+        toggle_favorite(self.user, self.sofa.pk)
+        self.assertEqual(get_favorite_ids(self.user), frozenset())
+        self.assertEqual(get_favorite_ids(AnonymousUser()), frozenset())
+
+    def test_favorite_list_query_count_does_not_depend_on_size(self):
+        request = RequestFactory().get(reverse('my_favorite'))
+        request.user = self.user
+
+        def load():
+            response = FavoriteListView.as_view()(request)
+            return [(product.pk, [image.image.name for image in product.images.all()])
+                    for product in response.context_data['products']]
+
+        toggle_favorite(self.user, self.sofa.pk)
+        with self.assertNumQueries(2):  # Товары + картинки
+            self.assertEqual(len(load()), 1)
+
+        for number in range(2, 6):
+            toggle_favorite(self.user, self.add_product(number).pk)
+        with self.assertNumQueries(2):
+            products = load()
+        self.assertEqual(len(products), 5)
+        self.assertEqual(products[0][0], Product.objects.get(slug='product-5').pk)  # Последние добавленные - первыми
+
+
+class RecommendationsTestCase(TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(user=User.objects.create_user(username='buyer',
+                                                                              password='password'))
+        category = Category.objects.create(title='Диваны', slug='divany')
+        self.a, self.b, self.c, self.d = [
+            Product.objects.create(title=name, description='-', price=1000, color_name='Белый', width='1',
+                                   depth='1', height='1', category=category, slug=name)
+            for name in 'abcd'
+        ]
+        for basket in ([self.a, self.b], [self.a, self.b], [self.a, self.c], [self.b, self.c, self.d]):
+            self.add_order(basket)
+        self.add_order([self.a, self.d], payment=False)  # Неоплаченные не учитываются
+
+    def add_order(self, products, payment=True):
+        order = Order.objects.create(customer=self.customer, payment=payment)
+        OrderProduct.objects.bulk_create(OrderProduct(order=order, product=product) for product in products)
+
+    def build(self, **options):
+        call_command('build_recommendations', stdout=StringIO(), **options)
+        return {(row.product_id, row.rank): (row.recommended_id, round(row.score, 3))
+                for row in ProductRecommendation.objects.all()}
+
+    def test_count_pairs(self):
+        a, b, c, d = (self.a.pk, self.b.pk, self.c.pk, self.d.pk)
+        pairs, counts, skipped = BuildRecommendations().count_pairs(max_order_size=50)
+
+        self.assertEqual(counts, {a: 3, b: 3, c: 2, d: 1})
+        self.assertEqual(pairs[a], {b: 2, c: 1})
+        self.assertEqual(pairs[d], {b: 1, c: 1})
+        self.assertEqual(pairs[b][a], pairs[a][b])
+        self.assertEqual(skipped, 0)
+
+    def test_cosine_scores_and_top_k(self):
+        a, b, c, d = (self.a.pk, self.b.pk, self.c.pk, self.d.pk)
+        rows = self.build()
+        # co(a, b) / sqrt(n(a) * n(b))
+        self.assertEqual(rows[(a, 1)], (b, round(2 / 3, 3)))
+        self.assertEqual(rows[(a, 2)], (c, round(1 / 6 ** 0.5, 3)))
+        self.assertEqual(rows[(d, 1)], (c, round(1 / 2 ** 0.5, 3)))
+        self.assertEqual(rows[(d, 2)], (b, round(1 / 3 ** 0.5, 3)))
+        self.assertNotIn((a, 3), rows)
+
+        rows = self.build(top_k=1)
+        self.assertEqual({key[1] for key in rows}, {1})
+        self.assertEqual(rows[(b, 1)][0], a)
+
+        self.assertNotIn((a, 2), self.build(min_support=2))
+
+    def test_oversized_orders_are_skipped(self):
+        before = self.build()
+        self.add_order([self.a, self.b, self.c, self.d])
+
+        self.assertEqual(self.build(max_order_size=3), before)
+        self.assertEqual(BuildRecommendations().count_pairs(max_order_size=3)[2], 1)
+
+    def test_bought_together_excludes_cart(self):
+        self.build()
+
+        self.assertEqual(get_bought_together([self.a.pk]), [self.b, self.c])
+        self.assertEqual(get_bought_together([self.a.pk], exclude=[self.b.pk]), [self.c])
+        # Рекомендации для корзины из a и c: товары корзины не предлагаются, порядок - по оценке
+        self.assertEqual(get_bought_together([self.a.pk, self.c.pk]), [self.d, self.b])
+        self.assertEqual(get_bought_together([self.a.pk, self.c.pk], limit=1), [self.d])
+
+
+class CommitStockTestCase(TestCase):
+    def setUp(self):
+        category = Category.objects.create(title='Диваны', slug='divany')
+        self.products = Product.objects.bulk_create([
+            Product(title=f'Диван {i}', description='-', price=1000, quantity=quantity, color_name='Белый',
+                    width='1', depth='1', height='1', category=category, slug=f'divan-{i}')
+            for i, quantity in enumerate([5, 3, 1])
+        ])
+        self.ids = [product.pk for product in self.products]
+
+    def get_stock(self):
+        return list(Product.objects.filter(pk__in=self.ids).order_by('pk').values_list('quantity', flat=True))
+
+    def count_updates(self, queries):
+        return sum(query['sql'].startswith('UPDATE') for query in queries)
+
+    def test_batch_is_one_conditional_update(self):
+        lines = [(self.ids[0], 2), (self.ids[1], 1), (self.ids[0], 1), (self.ids[2], 1)]
+        with CaptureQueriesContext(connection) as queries:
+            result = commit_stock(lines)
+
+        self.assertTrue(result.is_complete)
+        self.assertEqual(result.committed, {self.ids[0]: 3, self.ids[1]: 1, self.ids[2]: 1})
+        self.assertEqual(self.count_updates(queries), 1)
+        self.assertEqual(self.get_stock(), [2, 2, 0])
+
+    def test_short_last_unit_rolls_back_batch_to_savepoint(self):
+        lines = [(self.ids[0], 2), (self.ids[1], 1), (self.ids[2], 2)]
+        with CaptureQueriesContext(connection) as queries:
+            result = commit_stock(lines)
+
+        self.assertEqual(result.oversold, {self.ids[2]: 2})
+        self.assertEqual(result.committed, {self.ids[0]: 2, self.ids[1]: 1})
+        self.assertEqual(self.count_updates(queries), 4)  # Пачка целиком, затем по строке
+        self.assertEqual(self.get_stock(), [3, 2, 1])
+
+    def test_last_unit_is_sold_once(self):
+        self.assertTrue(commit_stock([(self.ids[2], 1)]).is_complete)
+        self.assertEqual(commit_stock([(self.ids[2], 1)]).oversold, {self.ids[2]: 1})
+        self.assertEqual(self.get_stock()[2], 0)
+        self.assertEqual(find_shortages([(self.ids[1], 3), (self.ids[2], 1)]), {self.ids[2]: 0})
+
+@override_settings(LOFT_PAYMENT_GATEWAY='loft.payments.FakeGateway')
+class CheckoutSessionTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.client.force_login(self.user)
+        category = Category.objects.create(title='Диваны', slug='divany')
+        product = Product.objects.create(title='Диван', description='-', price=1000, quantity=5, color_name='Белый',
+                                         width='1', depth='1', height='1', category=category, slug='divan')
+        self.order = Order.objects.create(customer=Customer.objects.create(user=self.user))
+        OrderProduct.objects.create(order=self.order, product=product, quantity=2)
+        self.region = Region.objects.create(title='Московская область')
+        self.city = City.objects.create(title='Москва', region=self.region)
+
+    def test_redirects_to_gateway_session(self):
+        response = self.client.post(reverse('payment'), {'address': 'ул. Ленина 1', 'phone': '+7900',
+                                                         'region': self.region.pk, 'city': self.city.pk,
+                                                         'comment': '-'})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith('http://testserver/success/payment/?session_id=fake_'))
+        self.assertEqual(ShippingAddress.objects.get().order, self.order)
+
+    def shipping_data(self, **data):
+        return {'address': 'ул. Ленина 1', 'phone': '+7900', 'region': self.region.pk, 'city': self.city.pk,
+                'comment': '-', **data}
+
+    def test_repeated_address_updates_existing_row(self):
+        save_shipping_address(self.order, {'address': 'ул. Ленина 1', 'phone': '+7900', 'comment': '-'})
+        save_shipping_address(self.order, {'address': 'ул. Мира 2', 'phone': '+7900', 'comment': '-'})
+
+        self.assertEqual(ShippingAddress.objects.get().address, 'ул. Мира 2')
+
+    def test_checkout_locks_order_and_starts_new_cart(self):
+        self.client.post(reverse('payment'), self.shipping_data())
+        self.client.post(reverse('cart_api'), {'product': 'divan', 'action': 'add'})
+
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.awaiting_payment)
+        self.assertEqual(self.order.total_quantity, 2)
+        self.assertEqual(get_user_order(self.user).total_quantity, 1)
+
+    def test_second_checkout_of_locked_order_is_rejected(self):
+        self.client.post(reverse('payment'), self.shipping_data())
+        response = self.client.post(reverse('payment'), self.shipping_data(address='ул. Мира 2'))
+
+        self.assertRedirects(response, reverse('checkout'), fetch_redirect_response=False)
+        self.assertEqual(ShippingAddress.objects.get().address, 'ул. Ленина 1')
+
+    def test_gateway_error_unlocks_order(self):
+        with mock.patch.object(FakeGateway, 'create_checkout_session', side_effect=PaymentError('offline')):
+            response = self.client.post(reverse('payment'), self.shipping_data())
+
+        self.assertRedirects(response, reverse('checkout'), fetch_redirect_response=False)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.awaiting_payment)
+        self.assertEqual(get_user_order(self.user), self.order)
+
+    def expire_payment(self, order):
+        Order.objects.filter(pk=order.pk).update(payment_started_at=timezone.now() - timedelta(hours=2))
+
+    def test_expired_payment_becomes_cart_again(self):
+        self.client.post(reverse('payment'), self.shipping_data())
+        empty_cart = get_user_order(self.user)
+        self.assertEqual(get_user_order(self.user), empty_cart)  # Страница оплаты ещё действует
+
+        self.expire_payment(self.order)
+        cart = get_user_order(self.user)
+
+        self.assertEqual(cart, self.order)
+        self.assertFalse(cart.awaiting_payment)
+        self.assertEqual(cart.total_quantity, 2)
+        self.assertFalse(Order.objects.filter(pk=empty_cart.pk).exists())
+        self.assertTrue(ShippingAddress.objects.filter(order=cart).exists())
+
+    def test_expired_payment_is_merged_into_new_cart(self):
+        self.client.post(reverse('payment'), self.shipping_data())
+        category = Category.objects.get(slug='divany')
+        Product.objects.create(title='Стол', description='-', price=500, quantity=5, color_name='Белый', width='1',
+                               depth='1', height='1', category=category, slug='stol')
+        self.client.post(reverse('cart_api'), {'product': 'stol', 'action': 'add'})
+
+        self.expire_payment(self.order)
+        cart = load_cart(self.user)
+
+        self.assertEqual(sorted(line.product.slug for line in cart.lines), ['divan', 'stol'])
+        self.assertEqual((cart.total_quantity, cart.total_price), (3, 2500))
+        self.assertFalse(Order.objects.filter(pk=self.order.pk).exists())
+        self.assertFalse(OrderProduct.objects.filter(order__isnull=True).exists())
+
+    def test_cancel_restores_cart_and_success_page_does_not_finalize(self):
+        self.client.post(reverse('payment'), self.shipping_data())
+        self.client.raise_request_exception = False  # Шаблонов страниц в репозитории нет
+        self.client.get(reverse('success'))
+        self.client.get(reverse('payment_cancel'))
+
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.payment)
+        self.assertFalse(Job.objects.filter(kind='finalize_order').exists())
+        cart = get_user_order(self.user)
+        self.assertNotEqual(cart, self.order)
+        self.assertEqual(cart.total_quantity, 2)
+
+    def test_shortage_is_reported_before_payment(self):
+        Product.objects.filter(slug='divan').update(quantity=1)
+
+        response = self.client.post(reverse('payment'), self.shipping_data())
+
+        self.assertRedirects(response, reverse('checkout'), fetch_redirect_response=False)
+        self.assertIn('Диван', str(list(get_messages(response.wsgi_request))[0]))
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.awaiting_payment)
+
+    def test_invalid_form_returns_to_checkout(self):
+        response = self.client.post(reverse('payment'), {'address': ''})
+
+        self.assertRedirects(response, reverse('checkout'), fetch_redirect_response=False)
+        self.assertFalse(ShippingAddress.objects.exists())
+
+
+@override_settings(LOFT_PAYMENT_GATEWAY='loft.payments.FakeGateway')
+class PaymentWebhookTestCase(TestCase):
+    def setUp(self):
+        category = Category.objects.create(title='Диваны', slug='divany')
+        self.product = Product.objects.create(title='Диван', description='-', price=1000, quantity=5,
+                                              color_name='Белый', width='1', depth='1', height='1',
+                                              category=category, slug='divan')
+        user = User.objects.create_user(username='buyer', password='password')
+        self.order = Order.objects.create(customer=Customer.objects.create(user=user))
+        OrderProduct.objects.create(order=self.order, product=self.product, quantity=2)
+        run_pending_jobs()  # Индексация товара
+
+    def send_webhook(self, signature=None):
+        payload = json.dumps({'order_id': self.order.pk, 'paid': True}).encode()
+        return self.client.post(reverse('payment_webhook'), payload, content_type='application/json',
+                                headers={'X-Fake-Signature': signature or FakeGateway.sign(payload)})
+
+    def test_repeated_webhook_finalizes_order_once(self):
+        self.assertEqual(self.send_webhook().status_code, 200)
+        self.assertEqual(self.send_webhook().status_code, 200)
+        self.assertEqual(Job.objects.filter(kind='finalize_order').count(), 1)
+
+        self.assertEqual(run_pending_jobs(), 1)
+
+        self.order.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertTrue(self.order.payment)
+        self.assertEqual(self.product.quantity, 3)
+        self.assertEqual(Job.objects.get(kind='finalize_order').status, Job.DONE)
+
+    def test_invalid_signature_is_rejected(self):
+        self.assertEqual(self.send_webhook(signature='bad').status_code, 400)
+        self.assertFalse(Job.objects.filter(kind='finalize_order').exists())
+
+    def test_failed_job_is_retried_later(self):
+        @job_handler('test_failing')
+        def failing(payload):
+            raise RuntimeError('boom')
+
+        job, created = enqueue('test_failing')
+        run_pending_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertIn('boom', job.last_error)
+        self.assertEqual(run_pending_jobs(), 0)  # Повтор отложен на run_after
+
+    def test_old_done_jobs_are_purged(self):
+        old = timezone.now() - timedelta(days=2)
+        for status in (Job.DONE, Job.FAILED):
+            Job.objects.filter(pk=enqueue('test', key=f'old-{status}')[0].pk).update(status=status, updated_at=old)
+        recent, created = enqueue('test', key='recent')
+        Job.objects.filter(pk=recent.pk).update(status=Job.DONE)
+
+        self.assertEqual(purge_done_jobs(), 1)
+        self.assertEqual(sorted(Job.objects.filter(kind='test').values_list('idempotency_key', flat=True)),
+                         ['old-failed', 'recent'])
+
+
+class RegionCitiesTestCase(TestCase):
+    def setUp(self):
+        self.region = Region.objects.create(title='Московская область')
+        City.objects.create(title='Москва', region=self.region)
+        City.objects.create(title='Химки', region=self.region)
+        self.url = reverse('region_cities', kwargs={'region_id': self.region.pk})
+
+    def test_cities_are_cached_and_etag_is_honoured(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual([title for title, pk in response.json()['cities']], ['Москва', 'Химки'])
+
+        response = self.client.get(self.url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_city_change_invalidates_cache(self):
+        version = self.client.get(self.url).json()['version']
+        City.objects.create(title='Подольск', region=self.region)
+
+        response = self.client.get(self.url, {'v': version})
+
+        self.assertNotEqual(response.json()['version'], version)
+        self.assertEqual(len(response.json()['cities']), 3)
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_cities_map_includes_empty_regions(self):
+        empty = Region.objects.create(title='Тверская область')
+
+        cities = get_cities_by_region()
+
+        self.assertEqual(len(cities[self.region.pk]), 2)
+        self.assertEqual(cities[empty.pk], [])
+
+
+class RenditionsTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.media = Path(directory.name)
+        override = self.settings(MEDIA_ROOT=self.media, LOFT_RENDITION_ASYNC=False, LOFT_RENDITION_WIDTHS=(8, 16),
+                                 LOFT_RENDITION_FORMATS=('jpeg',))
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def image(self, color):
+        buffer = BytesIO()
+        Image.new('RGB', (32, 32), color).save(buffer, format='PNG')
+        return SimpleUploadedFile(f'{color}.png', buffer.getvalue())
+
+    def save(self, category):
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+        category.refresh_from_db()
+        return category
+
+    def files(self):
+        return sorted(path.name for path in (self.media / 'renditions').glob('*'))
+
+    def test_settings_are_read_at_call_time(self):
+        category = self.save(Category(title='Диваны', slug='divany', icon=self.image('red')))
+
+        self.assertEqual(sorted(category.renditions['jpeg']), ['16', '8'])
+        self.assertEqual(len(self.files()), 2)
+        self.assertIn('8w', category.get_srcset('jpeg'))
+
+    def test_replaced_and_cleared_icon_drop_old_renditions(self):
+        category = self.save(Category(title='Диваны', slug='divany', icon=self.image('red')))
+        old_files = self.files()
+
+        category.icon = self.image('blue')
+        category = self.save(category)
+        self.assertEqual(len(self.files()), 2)
+        self.assertFalse(set(old_files) & set(self.files()))
+
+        category.icon = None
+        category = self.save(category)
+        self.assertEqual((category.renditions, category.get_srcset('jpeg')), ({}, ''))
+        self.assertEqual(self.files(), [])
+
+    def test_renditions_of_other_file_are_not_shown(self):
+        category = self.save(Category(title='Диваны', slug='divany', icon=self.image('red')))
+        category.icon.name = 'icons/other.png'
+
+        self.assertEqual(category.get_srcset('jpeg'), '')
+        self.assertEqual(category.get_rendition_url(8, 'jpeg'), category.icon.url)
+
+    def test_shared_files_are_kept_until_last_owner_is_deleted(self):
+        first = self.save(Category(title='Диваны', slug='divany', icon=self.image('red')))
+        second = self.save(Category(title='Столы', slug='stoly', icon=self.image('red')))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(len(self.files()), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertEqual(self.files(), [])
+
+class QueryInstrumentationTestCase(TestCase):
+    def test_disabled_unless_explicitly_enabled(self):
+        with self.assertNoLogs('loft.instrumentation'):
+            self.client.get(reverse('region_cities', kwargs={'region_id': 1}))
+
+    @override_settings(LOFT_INSTRUMENTATION=True)
+    def test_logs_queries_per_request(self):
+        with self.assertLogs('loft.instrumentation') as logs:
+            self.client.get(reverse('search_autocomplete'), {'q': 'диван'})
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['url_name'], 'search_autocomplete')
+        self.assertGreater(record['queries'], 0)
+
+
+class BenchmarkCommandsTestCase(TestCase):
+    def test_generate_catalog_and_run_benchmarks(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        baseline = Path(directory.name) / 'baseline.json'
+
+        with self.settings(MEDIA_ROOT=directory.name):
+            call_command('generate_catalog', categories=2, subcategories=2, models=3, products=30, images=1,
+                         users=2, favorites=2, orders=3, regions=1, cities=2, stdout=StringIO())
+            call_command('run_benchmarks', iterations=2, warmup=1, host='testserver', baseline=str(baseline),
+                         update_baseline=True, only=['category', 'my_cart'], username='bench-user-0',
+                         stdout=StringIO())
+
+        self.assertEqual(Product.objects.count(), 30)
+        results = json.loads(baseline.read_text())
+        self.assertEqual(sorted(results), ['category', 'category:warm', 'my_cart'])
+        self.assertGreater(results['category']['queries'], 0)  # Без кэша страниц
+
+class StaticFilesTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = Path(directory.name)
+        (self.root / 'loft').mkdir()
+        self.css = minify_css('body {\n    color: #333 ;\n}\n/* комментарий */\n' * 50).encode()
+        (self.root / 'loft/style.0123456789ab.css').write_bytes(self.css)
+        (self.root / 'loft/style.0123456789ab.css.gz').write_bytes(gzip.compress(self.css))
+        override = self.settings(STATIC_ROOT=self.root, LOFT_SERVE_STATIC=True)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_hashed_file_is_immutable_and_compressed(self):
+        response = self.client.get('/static/loft/style.0123456789ab.css', headers={'Accept-Encoding': 'gzip, br'})
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.css)
+
+    def test_plain_file_without_accept_encoding(self):
+        response = self.client.get('/static/loft/style.0123456789ab.css')
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), self.css)
+        self.assertNotIn('/*', self.css.decode())
+
+        response = self.client.get('/static/loft/style.0123456789ab.css',
+                                   headers={'If-Modified-Since': response['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'])
+    def test_collectstatic_minifies_hashed_files(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+        hashed_name = staticfiles_storage.stored_name('loft/style/style.css')
+        self.assertNotEqual(hashed_name, 'loft/style/style.css')
+        with staticfiles_storage.open(hashed_name) as file:
+            content = file.read()
+        self.assertNotIn(b'/*', content)
+        self.assertNotIn(b'\n    ', content)
+        with staticfiles_storage.open(hashed_name + '.gz') as file:
+            self.assertEqual(gzip.decompress(file.read()), content)
+
+    def test_paths_outside_static_root_are_not_served(self):
+        self.assertEqual(self.client.get('/static/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/static/loft/missing.css').status_code, 404)
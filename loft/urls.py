@@ -5,6 +5,8 @@ urlpatterns = [
     path('', ProductListView.as_view(), name='main'),
     path('product/<slug:slug>/', ProductDetail.as_view(), name='product'),
     path('category/<slug:slug>/', ProductByCategoryView.as_view(), name='category'),
+    path('search/', ProductSearchView.as_view(), name='search'),
+    path('search/autocomplete/', search_autocomplete_view, name='search_autocomplete'),
     path('login/', user_login_view, name='login'),
     path('logout/', user_logout_view, name='logout'),
     path('registration/', register_user_view, name='register'),
@@ -12,9 +14,14 @@ urlpatterns = [
     path('my_favorite/', FavoriteListView.as_view(), name='my_favorite'),
     path('sales/', SalesProductListView.as_view(), name='sales'),
     path('add_product/<slug:slug>/<str:action>/', add_product_order, name='add_product'),
+    path('cart/api/', cart_api_view, name='cart_api'),
     path('my_cart/', my_cart_view, name='my_cart'),
     path('delete/<int:pk>/<int:order>/', delete_products_cart, name='delete'),
     path('checkout/', checkout_view, name='checkout'),
+    path('cities/<int:region_id>/', region_cities_view, name='region_cities'),
     path('payment/', create_checkout_session, name='payment'),
-    path('success/payment/', success_payment, name='success')
+    path('success/payment/', success_payment, name='success'),
+    path('payment/webhook/', payment_webhook_view, name='payment_webhook'),
+    path('payment/cancel/', payment_cancel_view, name='payment_cancel'),
+    path('instrumentation/', instrumentation_report_view, name='instrumentation_report')
 ]
\ No newline at end of file
@@ -1,4 +1,134 @@
-from .models import Product, OrderProduct, Order, Customer
+import logging
+from dataclasses import dataclass
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Product, OrderProduct, Order, Customer, ShippingAddress
+from .payments import get_session_timeout
+from .inventory import commit_stock
+from .cart import update_cart_line
+from .cache import bump_version
+
+
+logger = logging.getLogger(__name__)
+
+
+# Строка корзины: товар уже загружен, фото и цена со скидкой посчитаны заранее
+@dataclass(frozen=True)
+class CartLine:
+    pk: int
+    product: Product
+    quantity: int
+    price: float
+    image_url: str
+
+    @property
+    def total_price(self):
+        return self.price * self.quantity
+
+    # Как у OrderProduct, чтобы шаблоны корзины работали без изменений
+    @property
+    def get_total_price(self):
+        return self.total_price
+
+
+# Неизменяемый снимок корзины, загружается фиксированным числом запросов
+@dataclass(frozen=True)
+class CartSnapshot:
+    order: Order
+    lines: tuple
+    total_price: float
+    total_quantity: int
+
+    def as_dict(self):
+        return {
+            'order_total_price': self.total_price,
+            'order_total_quantity': self.total_quantity,
+            'order': self.order,
+            'order_products': self.lines
+        }
+
+
+PAYMENT_WEBHOOK_GRACE = 60 * 10  # Запас на доставку вебхука после истечения страницы оплаты, секунд
+
+
+# Корзина покупателя. Тем же запросом находим зависшие на оплате заказы (release_stale_payments)
+def get_user_order(user):
+    customer, created = Customer.objects.get_or_create(user=user)
+    expired = timezone.now() - timedelta(seconds=get_session_timeout() + PAYMENT_WEBHOOK_GRACE)
+    # payment_started_at = NULL - заказы, переданные на оплату до появления этого поля
+    stale = Q(awaiting_payment=True) & (Q(payment_started_at__lt=expired) | Q(payment_started_at__isnull=True))
+    orders = list(Order.objects.filter(Q(awaiting_payment=False) | stale, customer=customer, payment=False)
+                  .order_by('pk'))
+    stale = [order for order in orders if order.awaiting_payment]
+    if stale:
+        release_stale_payments(customer, stale)
+    elif orders:
+        return orders[0]
+    order, created = Order.objects.get_or_create(customer=customer, payment=False, awaiting_payment=False)
+    return order
+
+
+# Покупатель закрыл страницу оплаты или нажал "Назад": страница оплаты истекла, а заказ так и
+# остался зафиксированным. Возвращаем его товары в корзину: если корзины нет или она пуста,
+# заказ снова становится корзиной (с адресом), иначе его строки добавляются в корзину, а сам он удаляется
+def release_stale_payments(customer, stale):
+    for order in stale:
+        with transaction.atomic():
+            cart = Order.objects.filter(customer=customer, payment=False, awaiting_payment=False).first()
+            pending = Order.objects.filter(pk=order.pk, payment=False, awaiting_payment=True)
+            if cart is None or not cart.orderproduct_set.exists():
+                if pending.update(awaiting_payment=False, payment_started_at=None):
+                    Order.objects.filter(pk=order.pk).update_totals()  # Цены могли измениться
+                    if cart is not None:
+                        cart.delete()
+            elif pending.exists():
+                copy_lines(order, cart)
+                OrderProduct.objects.filter(order=order).delete()
+                ShippingAddress.objects.filter(order=order).delete()
+                pending.delete()
+
+
+# Копирование товаров заказа в корзину; товары, которые уже лежат в корзине, не трогаем
+def copy_lines(source, target):
+    lines = [OrderProduct(order=target, product_id=product_id, quantity=quantity)
+             for product_id, quantity in source.orderproduct_set.filter(product__isnull=False)
+             .values_list('product_id', 'quantity')]
+    OrderProduct.objects.bulk_create(lines, ignore_conflicts=True)
+    Order.objects.filter(pk=target.pk).update_totals()
+
+
+# Загрузка корзины: покупатель, заказ, строки с товарами и фото товаров (4 запроса)
+def load_cart(user):
+    order = get_user_order(user)
+    order_products = (OrderProduct.objects.filter(order=order, product__isnull=False)
+                      .select_related('product')
+                      .prefetch_related('product__images')
+                      .order_by('added_at', 'pk'))
+
+    lines = []
+    for order_product in order_products:
+        product = order_product.product
+        price = product.price
+        if product.discount:
+            price -= (price * product.discount) / 100
+
+        lines.append(CartLine(
+            pk=order_product.pk,
+            product=product,
+            quantity=order_product.quantity,
+            price=price,
+            image_url=product.get_first_photo()
+        ))
+
+    return CartSnapshot(
+        order=order,
+        lines=tuple(lines),
+        total_price=order.total_price,
+        total_quantity=order.total_quantity
+    )
+
 
 class CartForAuthenticatedUser:
     def __init__(self, request, products_slug=None, action=None):
@@ -10,56 +140,66 @@ class CartForAuthenticatedUser:
 
     # Метод для получения товара из корзины
     def get_cart_info(self):
-        customer, created = Customer.objects.get_or_create(user=self.user)
+        return load_cart(self.user).as_dict()
+
+    # Метод для добавления товара в корзину и его удаление
+    def add_or_delete(self, product_slug, action):
+        order = get_user_order(self.user)
+        product = Product.objects.only('pk', 'quantity').get(slug=product_slug)
+        return update_cart_line(order, product, action)
 
-        order, created = Order.objects.get_or_create(customer=customer, payment=False)
-        order_products = order.orderproduct_set.all()
 
-        order_total_price = order.get_order_total_price
-        order_total_quantity = order.get_order_total_quantity
 
-        return {
-            'order_total_price': order_total_price,
-            'order_total_quantity': order_total_quantity,
-            'order': order,
-            'order_products': order_products
-        }
+# Начало оплаты: корзина фиксируется условным UPDATE (повторный или параллельный запрос
+# получит False), дальше покупатель работает с новой корзиной (get_user_order).
+# Оплаченным заказ делает только подтверждённый вебхук (jobs.finalize_order_job).
+def start_payment(order):
+    locked = (Order.objects.filter(pk=order.pk, payment=False, awaiting_payment=False, total_quantity__gt=0)
+              .update(awaiting_payment=True, payment_started_at=timezone.now()))
+    if locked:
+        order.refresh_from_db(fields=['awaiting_payment', 'payment_started_at', 'total_price', 'total_quantity'])
+    return bool(locked)
+
+
+# Платёж не создан - возвращаем заказ в корзину
+def cancel_payment(order):
+    Order.objects.filter(pk=order.pk, payment=False).update(awaiting_payment=False, payment_started_at=None)
 
-    # Метод для добавления товара в корзину и его удаление
-    def add_or_delete(self, product_slug, action):
-        order = self.get_cart_info()['order']
-        product = Product.objects.get(slug=product_slug)
-        order_product, created = OrderProduct.objects.get_or_create(order=order, product=product)
 
-        if action == 'add' and product.quantity > 0 and product.quantity > order_product.quantity:
-            order_product.quantity += 1
-        elif action == 'delete':
-            order_product.quantity -= 1
+# Покупатель вернулся со страницы оплаты без оплаты: заказ остаётся зафиксированным
+# (по старой ссылке его ещё можно оплатить), а его товары копируем в текущую корзину
+def restore_cart(user):
+    order = get_user_order(user)
+    pending = (Order.objects.filter(customer=order.customer, payment=False, awaiting_payment=True)
+               .order_by('-pk').first())
+    if pending is None:
+        return order
 
-        order_product.save()
+    copy_lines(pending, order)
+    return order
 
-        if order_product.quantity <= 0:
-            order_product.delete()
 
+# Оплата заказа: отмечаем оплату и списываем остатки в одной транзакции.
+# Оплату ставим условным UPDATE, поэтому повторный вызов ничего не спишет.
+def finalize_order(order):
+    with transaction.atomic():
+        paid = Order.objects.filter(pk=order.pk, payment=False).update(payment=True)
+        if not paid:
+            return None
 
-    def clear_cart(self):
-        order = self.get_cart_info()['order']
-        order_products = order.orderproduct_set.all()
-        for order_product in order_products:
-            item = Product.objects.get(pk=order_product.product.pk)
-            item.quantity -= order_product.quantity
-            item.save()
+        lines = order.orderproduct_set.values_list('product_id', 'quantity')
+        result = commit_stock(lines)
+    bump_version('catalog')  # Изменились остатки товаров на страницах каталога
 
-        order.payment = True
-        order.save()
+    if result.oversold:
+        logger.warning('Заказ №%s: не хватило товаров на складе %s', order.pk, result.oversold)
+    return result
 
 
 
 # Функция для получения данных о корзина товаров
 def get_cart_data(request):
-    order = CartForAuthenticatedUser(request)
-    order_info = order.get_cart_info()
-    return order_info
+    return load_cart(request.user).as_dict()
 
 
 
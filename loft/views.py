@@ -1,95 +1,136 @@
-from django.shortcuts import render, redirect
+import logging
+from django.shortcuts import render, redirect, get_object_or_404
 from .models import *
 from django.views.generic import ListView, DetailView
+from django.db import transaction
 from .forms import LoginForm, RegisterForm, ShippingForm
+from django.contrib import messages
 from django.contrib.auth import login, logout
 from django.contrib.auth.mixins import LoginRequiredMixin
-from .utils import CartForAuthenticatedUser, get_cart_data
-from shop.settings import STRIPE_SECRET_KEY
-import stripe
+from .utils import (CartForAuthenticatedUser, get_cart_data, get_user_order, start_payment, cancel_payment,
+                    restore_cart)
+from .cart import CartError, update_cart_line, run_idempotent
+from .inventory import find_shortages
+from .filters import ProductFilter
+from .facets import get_category_facets
+from .pagination import KeysetPaginationMixin
+from .catalog import (RECOMMENDATIONS_LIMIT, get_category_tree, get_product_variants, get_recommended_products,
+                      get_bought_together)
+from .cache import CatalogCacheMixin
+from .search import SearchResults, get_search_backend
+from django.http import JsonResponse, Http404
+from .favorites import toggle_favorite
+from .instrumentation import get_report, reset_report
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.http import require_POST
+from .payments import PaymentError, get_payment_gateway
+from .jobs import enqueue_finalize_order
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+from django.utils.cache import patch_cache_control
+from .regions import get_cities_by_region, get_region_cities, get_regions_version
+from asgiref.sync import sync_to_async
+
+
+logger = logging.getLogger(__name__)
 
 
 # Create your views here.
 
-class ProductListView(ListView):
+class ProductListView(CatalogCacheMixin, ListView):
     model = Product
     context_object_name = 'categories'
     template_name = 'loft/index.html'
     extra_context = {'title': 'LOFT МЕБЕЛЬ'}
 
     def get_queryset(self):
-        categories = Category.objects.filter(parent=None)
-        return categories
+        return get_category_tree()
 
 
 # Вьюшка для страницы детали товара
-class ProductDetail(DetailView):
+class ProductDetail(CatalogCacheMixin, DetailView):
     model = Product
     context_object_name = 'product'
 
+    def get_queryset(self):
+        return Product.objects.select_related('category', 'model').with_images()
+
     def get_context_data(self, **kwargs):
-        context = super().get_context_data()
-        product = Product.objects.get(slug=self.kwargs['slug'])
-        products = Product.objects.filter(category=product.category).exclude(
-            slug=product.slug)  # РЕкомендованные товары
+        context = super().get_context_data(**kwargs)
+        product = self.object
+        products = get_recommended_products(product)  # Рекомендованные товары (из кэша, не больше 8)
 
         context['title'] = product.title
         context['products'] = products
+        context['bought_together'] = get_bought_together([product.pk])
+        context['variants'] = get_product_variants([product, *products])
         return context
 
 
-class ProductByCategoryView(ListView):
+class ProductByCategoryView(CatalogCacheMixin, KeysetPaginationMixin, ListView):
     model = Product
     context_object_name = 'products'
     template_name = 'loft/category_page.html'
     paginate_by = 2
 
     def get_queryset(self):
-        sub = self.request.GET.get('sub')
-        color_name = self.request.GET.get('color_name')
-        model = self.request.GET.get('model')
-        price_from = self.request.GET.get('from')
-        price_till = self.request.GET.get('till')
-
-        category = Category.objects.get(slug=self.kwargs['slug'])
-        subcategories = category.subcategories.all()
-        products = Product.objects.filter(category__in=subcategories)
-
-        if sub:
-            products = products.filter(category__title=sub)
-        if color_name:
-            products = products.filter(color_name=color_name)
-        if model:
-            products = products.filter(model__title=model)
-        if price_from:
-            products = [i for i in products if int(i.price) >= int(price_from)]
-        if price_till:
-            products = [i for i in products if int(i.price) <= int(price_till)]
-
-        return products
+        self.category = get_object_or_404(Category, slug=self.kwargs['slug'])
+        product_filter = ProductFilter(self.category, self.request.GET)
+        return product_filter.get_queryset()
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data()
-        category = Category.objects.get(slug=self.kwargs['slug'])
+        category = self.category
         context['title'] = category.title
-        subcategories = category.subcategories.all()
-        products = Product.objects.filter(category__in=subcategories)
-        context['color_names'] = list(set([i.color_name for i in products]))
-        context['models'] = list(set([i.model for i in products]))
+        facets = get_category_facets(category)
+        context['color_names'] = [i['color_name'] for i in facets['colors']]
+        context['color_facets'] = facets['colors']  # [{'color_name': ..., 'count': ...}]
+        context['models'] = facets['models']  # У каждой модели есть products_count
         context['prices'] = [i for i in range(500, 10000, 500)]
-        context['subcategories'] = subcategories
+        context['subcategories'] = facets['subcategories']  # У каждой подкатегории есть products_count
+        context['variants'] = get_product_variants(context['object_list'])  # Цвета товаров страницы
 
         # context['sub'] = self.request.GET.get('sub')
         # context['color_name'] = self.request.GET.get('color_name')
         # context['model'] = self.request.GET.get('model')
         # context['price_from'] = self.request.GET.get('from')
         # context['price_till'] = self.request.GET.get('till')
-        print(self.request.GET, '=========================')
         context['query'] = self.request.GET
 
         return context
 
 
+# Вьюшка для поиска товаров
+class ProductSearchView(ListView):
+    model = Product
+    context_object_name = 'products'
+    template_name = 'loft/search.html'
+    paginate_by = 12
+
+    def get_queryset(self):
+        self.query = self.request.GET.get('q', '').strip()
+        if not self.query:
+            return []
+        return SearchResults(self.query)
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        context = super().get_context_data(object_list=object_list, **kwargs)
+        context['title'] = f'Поиск: {self.query}' if self.query else 'Поиск'
+        context['q'] = self.query
+        context['variants'] = get_product_variants(context['object_list'])
+        return context
+
+
+# Подсказки для строки поиска (по мере ввода)
+def search_autocomplete_view(request):
+    query = request.GET.get('q', '').strip()
+    ids = get_search_backend().search(query, limit=8) if query else []
+    products = {i.pk: i for i in Product.objects.filter(pk__in=ids).only('pk', 'title', 'slug')}
+    results = [{'title': products[i].title, 'url': products[i].get_absolute_url()} for i in ids if i in products]
+    return JsonResponse({'results': results})
+
+
 def user_login_view(request):
     if request.user.is_authenticated:
         return redirect('main')
@@ -148,15 +189,10 @@ def save_favorite_product(request, slug):
     if not request.user.is_authenticated:
         return redirect('login')
     else:
-        user = request.user
-        product = Product.objects.get(slug=slug)
-        favorite_products = FavoriteProduct.objects.filter(user=user)
-        if user:
-            if product in [i.product for i in favorite_products]:
-                fav_product = FavoriteProduct.objects.get(product=product, user=user)
-                fav_product.delete()
-            else:
-                FavoriteProduct.objects.create(product=product, user=user)
+        product_id = Product.objects.filter(slug=slug).values_list('pk', flat=True).first()
+        if product_id is None:
+            raise Http404('Товар не найден')
+        toggle_favorite(request.user, product_id)
 
         next_page = request.META.get('HTTP_REFERER', 'main')
         return redirect(next_page)
@@ -172,24 +208,28 @@ class FavoriteListView(LoginRequiredMixin, ListView):
     }
 
     def get_queryset(self):
-        favorites = FavoriteProduct.objects.filter(user=self.request.user)
-        favorites = [i.product for i in favorites]
-        return favorites
+        favorites = Product.objects.filter(favoriteproduct__user=self.request.user).with_images()
+        return favorites.order_by('-favoriteproduct__created_at')
 
 
-class SalesProductListView(ListView):
+class SalesProductListView(KeysetPaginationMixin, ListView):
     model = Product
     context_object_name = 'products'
     template_name = 'loft/favorite.html'
     login_url = 'login'
+    paginate_by = 12
     extra_context = {
         'title': 'Товары по акции'
     }
 
     def get_queryset(self):
-        products = Product.objects. all()
-        products = [i for i in products if i.discount]
-        return products
+        products = Product.objects.on_sale().with_sale_price().with_images()
+        return products.order_by('-created_at', '-pk')
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        context = super().get_context_data(object_list=object_list, **kwargs)
+        context['variants'] = get_product_variants(context['object_list'])
+        return context
 
 
 
@@ -198,18 +238,68 @@ def add_product_order(request, slug, action):
     if not request.user.is_authenticated:
         return redirect('login')
     else:
-        user_cart = CartForAuthenticatedUser(request, slug, action)
+        try:
+            CartForAuthenticatedUser(request, slug, action)
+        except CartError:
+            raise Http404('Неизвестное действие')
         next_page = request.META.get('HTTP_REFERER', 'main')
         return redirect(next_page)
 
 
+# JSON API корзины для кнопок +/- без перезагрузки страницы.
+# POST product=<slug>, action=add|delete|remove|set, quantity=<число для set>.
+# Заголовок Idempotency-Key защищает от повторного применения того же нажатия.
+@require_POST
+def cart_api_view(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Требуется авторизация'}, status=401)
+
+    action = request.POST.get('action')
+    quantity = request.POST.get('quantity')
+    product = Product.objects.filter(slug=request.POST.get('product')).only('pk', 'slug', 'price', 'discount', 'quantity').first()
+    if product is None:
+        return JsonResponse({'error': 'Товар не найден'}, status=404)
+    if quantity is not None:
+        try:
+            quantity = int(quantity)  # Отрицательное число отклонит update_cart_line (CartError)
+        except ValueError:
+            return JsonResponse({'error': 'Некорректное количество'}, status=400)
+
+    def change_cart():
+        order = get_user_order(request.user)
+        line_quantity = update_cart_line(order, product, action, quantity)
+        order.refresh_from_db(fields=['total_price', 'total_quantity'])
+        price = product.price - product.price * (product.discount or 0) / 100
+        return {
+            'product': product.slug,
+            'quantity': line_quantity,
+            'line_total_price': price * line_quantity,
+            'order_total_price': order.total_price,
+            'order_total_quantity': order.total_quantity,
+        }
+
+    try:
+        data = run_idempotent(request.user.pk, request.headers.get('Idempotency-Key'), change_cart)
+    except CartError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    if data is None:
+        return JsonResponse({'error': 'Запрос с этим ключом ещё выполняется'}, status=409)
+    return JsonResponse(data)
+
+
 def my_cart_view(request):
     if not request.user.is_authenticated:
         return redirect('login')
     else:
         order_info =get_cart_data(request)
         order_products = order_info['order_products']
-        products = Product.objects.all()[::-1][:8]
+        # Товары, которые покупают вместе с товарами корзины, если их нет - новинки
+        cart_ids = [i.product.pk for i in order_products]
+        products = get_bought_together(cart_ids)
+        if len(products) < RECOMMENDATIONS_LIMIT:
+            exclude = cart_ids + [i.pk for i in products]
+            products += list(Product.objects.exclude(pk__in=exclude).with_images()
+                             .order_by('-pk')[:RECOMMENDATIONS_LIMIT - len(products)])
         context = {
             'title': 'Ваша корзина',
             'order': order_info['order'],
@@ -224,7 +314,9 @@ def delete_products_cart(request, pk, order):
     if not request.user.is_authenticated:
         return redirect('login')
     else:
-        order_product = OrderProduct.objects.get(pk=pk, order=order)
+        # Только из своей открытой корзины: заказ, переданный на оплату, не меняется
+        order_product = get_object_or_404(OrderProduct, pk=pk, order=order, order__customer__user=request.user,
+                                          order__payment=False, order__awaiting_payment=False)
         order_product.delete()
         return redirect('my_cart')
 
@@ -234,17 +326,16 @@ def checkout_view(request):
         return redirect('login')
     else:
         order_info = get_cart_data(request)
-        print(request.META, '====================================')
         if order_info['order_products']:
-            regions = Region.objects.all()
-            dict_city = {i.pk: [[j.title, j.pk] for j in i.cities.all()] for i in regions}
-            print(dict_city)
+            # dict_city - из кэша (regions.py), без запросов на каждый показ страницы.
+            # Для отдельной загрузки городов есть {% url 'region_cities' pk %}?v=cities_version
             context = {
                 'title': 'Оформление заказа',
                 'order': order_info['order'],
                 'items': order_info['order_products'],
                 'form': ShippingForm(),
-                'dict_city': dict_city
+                'dict_city': get_cities_by_region(),
+                'cities_version': get_regions_version()
             }
 
             return render(request, 'loft/checkout.html', context)
@@ -254,52 +345,109 @@ def checkout_view(request):
 
 
 
-def create_checkout_session(request):
+CITIES_MAX_AGE = 60 * 60 * 24 * 365
+CITIES_UNVERSIONED_MAX_AGE = 60 * 5
+
+
+# Города региона в JSON для формы оформления заказа.
+# ETag зависит от версии справочника, поэтому браузер получает 304 без тела ответа.
+# Запрос с актуальной версией в ?v= кэшируется браузером надолго: после изменения городов версия другая.
+@condition(etag_func=lambda request, region_id: f'{get_regions_version()}-{region_id}')
+def region_cities_view(request, region_id):
+    version = str(get_regions_version())
+    response = JsonResponse({'version': version, 'cities': get_region_cities(region_id)})
+    if request.GET.get('v') == version:
+        patch_cache_control(response, public=True, max_age=CITIES_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=CITIES_UNVERSIONED_MAX_AGE)
+    return response
+
+
+# Асинхронная вьюшка: под ASGI ожидание платёжного сервиса не занимает поток воркера.
+# Работа с базой идёт в sync_to_async, запрос к шлюзу - в event loop (см. payments.py)
+async def create_checkout_session(request):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return redirect('login')
+    if request.method != 'POST':
+        return redirect('checkout')
+
+    order = await sync_to_async(prepare_checkout)(request, user)
+    if order is None:
+        return redirect('checkout')
+
+    try:
+        session = await get_payment_gateway().create_checkout_session(
+            order_id=order.pk,
+            amount=int(order.total_price) * 100,
+            success_url=request.build_absolute_uri(reverse('success')),
+            cancel_url=request.build_absolute_uri(reverse('payment_cancel'))
+        )
+    except PaymentError:
+        logger.exception('Не удалось создать платёж для заказа №%s', order.pk)
+        await sync_to_async(cancel_payment)(order)
+        return redirect('checkout')
+
+    return redirect(session.url, 303)
+
+
+# Фиксация корзины для оплаты и адрес доставки. Возвращает заказ или None, если форма
+# не прошла проверку, товара не хватает на складе, корзина пуста или уже передана на оплату
+def prepare_checkout(request, user):
+    order = get_user_order(user)
+    shipping_form = ShippingForm(data=request.POST)
+    if not shipping_form.is_valid():
+        return None
+
+    shortages = find_shortages(order.orderproduct_set.values_list('product_id', 'quantity'))
+    if shortages:
+        titles = Product.objects.filter(pk__in=shortages).values_list('title', flat=True)
+        messages.error(request, f'Недостаточно товара на складе: {", ".join(titles)}')
+        return None
+
+    with transaction.atomic():
+        if not start_payment(order):
+            return None
+        save_shipping_address(order, shipping_form.cleaned_data)
+    return order
+
+
+# Адрес доставки заказа: создаётся или обновляется по уникальному order
+def save_shipping_address(order, data):
+    ShippingAddress.objects.update_or_create(order=order, defaults={'customer_id': order.customer_id, **data})
+
+
+# Возврат со страницы оплаты без оплаты: товары заказа снова в корзине
+def payment_cancel_view(request):
     if not request.user.is_authenticated:
         return redirect('login')
-    else:
-        stripe.api_key = STRIPE_SECRET_KEY
-        if request.method == 'POST':
-            order_info = get_cart_data(request)
-            shipping_form = ShippingForm(data=request.POST)
-            ship_address = ShippingAddress.objects.all()
-            if shipping_form.is_valid():
-                shipping = shipping_form.save(commit=False)
-                shipping.customer = Customer.objects.get(user=request.user)
-                shipping.order = order_info['order']
-                print(order_info['order'])
-                if order_info['order'] not in [i.order for i in ship_address]:
-                    shipping.save()
-            else:
-                return redirect('checkout')
+    restore_cart(request.user)
+    return redirect('checkout')
+
 
-            order_price = order_info['order_total_price']
-            session = stripe.checkout.Session.create(
-                line_items=[{
-                    'price_data': {
-                        'currency': 'rub',
-                        'product_data': {'name': 'Товары магазина LOFT'},
-                        'unit_amount': int(order_price) * 100
-                    },
-                    'quantity': 1
-                }],
-                mode='payment',
-                success_url=request.build_absolute_uri(reverse('success')),
-                cancel_url=request.build_absolute_uri(reverse('checkout'))
-            )
 
-            return redirect(session.url, 303)
 
+# Уведомление платёжного сервиса об оплате: проверяем подпись и ставим задачу на закрытие заказа
+@csrf_exempt
+@require_POST
+def payment_webhook_view(request):
+    try:
+        event = get_payment_gateway().parse_webhook(request.body, request.headers)
+    except PaymentError:
+        logger.warning('Отклонён вебхук платёжного сервиса', exc_info=True)
+        return JsonResponse({'error': 'Некорректное уведомление'}, status=400)
 
+    if event and event.paid:
+        enqueue_finalize_order(event.order_id)
+    return JsonResponse({'received': True})
 
 
 def success_payment(request):
     if not request.user.is_authenticated:
         return redirect('login')
     else:
-        cart = CartForAuthenticatedUser(request)
-        cart.clear_cart()
-
+        # Заказ оплаченным здесь не отмечаем: переход на эту страницу ничего не подтверждает.
+        # Оплату и списание остатков делает задача, поставленная подписанным вебхуком (payment_webhook_view)
         context = {
                 'title': 'Успешная оплата'
             }
@@ -308,10 +456,16 @@ def success_payment(request):
 
 
 
+# Отчёт по скорости страниц и запросам к базе (собирает QueryInstrumentationMiddleware)
+@staff_member_required
+def instrumentation_report_view(request):
+    if request.method == 'POST':
+        reset_report()
+        return redirect('instrumentation_report')
 
-
-
-
-
-
-
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Производительность страниц',
+        'report': get_report()
+    }
+    return render(request, 'admin/loft/instrumentation_report.html', context)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,7 +43,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'loft.instrumentation.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'loft.staticfiles.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -66,6 +69,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'loft.context_processors.favorites',
             ],
         },
     },
@@ -125,9 +129,66 @@ STATICFILES_DIRS = [
     BASE_DIR / 'loft/static'
 ]
 
+# collectstatic минифицирует CSS/JS, добавляет хэш в имена и готовит .gz/.br копии (loft/staticfiles.py)
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'loft.staticfiles.LoftStaticFilesStorage',
+    },
+}
+
+# Раздача собранной статики самим приложением (StaticFilesMiddleware), если перед ним нет nginx
+LOFT_SERVE_STATIC = True
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Замер запросов к базе и времени ответа по каждой странице (loft/instrumentation.py).
+# Пишет строку в лог на каждый запрос, поэтому включается явно: LOFT_INSTRUMENTATION=1 python manage.py runserver
+LOFT_INSTRUMENTATION = os.environ.get('LOFT_INSTRUMENTATION') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'loft': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
+# Кэш. LocMemCache у каждого процесса свой: bump_version (loft/cache.py) в одном воркере
+# не сбрасывает кэш остальных, и изменения каталога доходят до них только по истечении таймаутов.
+# При нескольких воркерах gunicorn/uvicorn нужен общий бэкенд, например
+# 'django.core.cache.backends.redis.RedisCache' с LOCATION 'redis://127.0.0.1:6379'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Время жизни дерева категорий в кэше (loft/catalog.py)
+LOFT_CATEGORY_TREE_TIMEOUT = 60 * 10
+
+# Время жизни закэшированных страниц каталога для анонимных посетителей (loft/cache.py)
+LOFT_PAGE_CACHE_TIMEOUT = 60 * 10
+
+# Сколько рекомендованных товаров показывать на странице товара
+LOFT_RECOMMENDATIONS_LIMIT = 8
+
+# Уменьшенные копии фото товаров и иконок категорий (loft/renditions.py)
+LOFT_RENDITION_WIDTHS = (160, 320, 640, 1280)
+LOFT_RENDITION_FORMATS = ('webp', 'jpeg')
+LOFT_RENDITION_WORKERS = 2
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -141,6 +202,26 @@ STRIPE_PUBLIC_KEY = ''
 STRIPE_SECRET_KEY = ''
 
 
+STRIPE_WEBHOOK_SECRET = ''
+
+
+# Платёжный шлюз (loft/payments.py). Для тестов и бенчмарков без Stripe: 'loft.payments.FakeGateway'
+LOFT_PAYMENT_GATEWAY = 'loft.payments.StripeGateway'
+LOFT_PAYMENT_TIMEOUT = 10  # секунд на запрос к платёжному сервису
+LOFT_PAYMENT_MAX_RETRIES = 2
+# Сколько живёт страница оплаты. После этого (плюс запас на доставку вебхука) неоплаченный
+# заказ возвращается в корзину покупателя (utils.release_stale_payments). У Stripe от 30 минут до 24 часов
+LOFT_PAYMENT_SESSION_TIMEOUT = 60 * 60
+LOFT_FAKE_PAYMENT_DELAY = 0  # Имитация задержки платёжного сервиса для FakeGateway, секунд
+
+
+# Очередь фоновых задач (loft/jobs.py, python manage.py run_workers)
+LOFT_JOB_MAX_ATTEMPTS = 5
+LOFT_JOB_RETRY_DELAY = 30  # секунд, удваивается с каждой попыткой
+LOFT_JOB_LOCK_TIMEOUT = 60 * 10
+LOFT_JOB_KEEP_DONE = 60 * 60 * 24  # Выполненные задачи удаляются через сутки, упавшие остаются
+
+
 
 
 